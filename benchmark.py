@@ -0,0 +1,608 @@
+"""
+    Tangent
+    Copyright (c) 2013 David Stalnaker, Richard Zanibbi
+
+    This file is part of Tangent.
+
+    Tanget is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Tangent is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Tangent.  If not, see <http://www.gnu.org/licenses/>.
+
+    Contact:
+        - David Stalnaker: david.stalnaker@gmail.com
+        - Richard Zanibbi: rlaz@cs.rit.edu
+"""
+
+"""
+Benchmarks of index construction and search
+
+Runs on generated expressions so results do not depend on a collection being available. The suite
+indexes a synthetic mathml corpus into a MemoryRedis, so its numbers measure Tangent itself
+without the network and server costs of a real redis.
+"""
+
+from sys import argv, exit
+from random import Random
+import StringIO
+import json
+import os
+import platform
+import tempfile
+import time
+
+import numpy as np
+
+from tangent import SymbolTree, Symbol, SegmentWriter, SegmentIndex, RedisIndex, ShardedIndex, MemoryRedis, all_rankers
+from tangent.options import parse_options
+
+
+def chain(symbols, link):
+    """
+    Link symbols into a chain through the given child attribute, and return the first one
+    """
+    for first, second in zip(symbols, symbols[1:]):
+        setattr(first, link, second)
+    return symbols[0]
+
+
+def long_sum(n):
+    """
+    Return x_1 + x_2 + ... + x_n, a long chain of next links
+    """
+    symbols = []
+    for i in range(1, n + 1):
+        symbols.extend([Symbol('x', below=Symbol(str(i))), Symbol('+')])
+    return SymbolTree(chain(symbols[:-1], 'next'))
+
+
+def nested_powers(n):
+    """
+    Return x^{1+x^{2+...}} nested n times, a deep chain of above links
+    """
+    symbols = [Symbol('x', next=Symbol('+', next=Symbol(str(i)))) for i in range(n)]
+    return SymbolTree(chain(symbols, 'above'))
+
+
+def matrix(n):
+    """
+    Return a square matrix of about n entries written as a row of fenced rows
+    """
+    side = max(int(n ** 0.5), 1)
+    symbols = []
+    for _ in range(side):
+        symbols.append(Symbol('('))
+        symbols.extend(Symbol('a') for _ in range(side))
+        symbols.append(Symbol(')'))
+    return SymbolTree(chain(symbols, 'next'))
+
+
+GENERATORS = [('sum', long_sum), ('power', nested_powers), ('matrix', matrix)]
+
+
+# Relative frequency of the node kinds of each expression shape.
+SHAPES = {
+    'sum': {'row': 6, 'sub': 2, 'sup': 1, 'frac': 1},
+    'power': {'row': 2, 'sup': 6, 'sub': 1, 'frac': 1},
+    'frac': {'row': 2, 'frac': 6, 'sqrt': 1, 'sup': 1},
+    'mixed': {'row': 3, 'sub': 2, 'sup': 2, 'frac': 2, 'sqrt': 1},
+}
+# Identifiers are drawn with zipfian weights, so a few pairs are very common as in real collections.
+IDENTIFIERS = 'xyzabcnijkmtpqr'
+OPERATORS = ['+', '-', '=', '&lt;', '&gt;']
+MATHML = '<math xmlns="http://www.w3.org/1998/Math/MathML" alttext="%s">%s</math>'
+
+
+def synthetic_node(rng, size, shape):
+    """
+    Return the mathml of a random expression with about size leaves
+
+    :type rng: Random
+    :param rng: random number generator
+
+    :type size: int
+    :param size: number of leaves
+
+    :type shape: string
+    :param shape: key of SHAPES giving the frequency of each node kind
+
+    :rtype: string
+    :return: presentation mathml
+    """
+    if size <= 1:
+        if rng.random() < 0.25:
+            return '<mn>%d</mn>' % rng.randint(0, 9)
+        i = min(int(rng.paretovariate(1.2)) - 1, len(IDENTIFIERS) - 1)
+        return '<mi>%s</mi>' % IDENTIFIERS[i]
+
+    kinds = SHAPES[shape]
+    pick = rng.uniform(0, sum(kinds.values()))
+    for kind, weight in sorted(kinds.items()):
+        pick -= weight
+        if pick <= 0:
+            break
+    if kind == 'row':
+        parts = []
+        while size > 0:
+            part = min(rng.randint(1, 3), size)
+            parts.append(synthetic_node(rng, part, shape))
+            size -= part
+        ops = ['<mo>%s</mo>' % rng.choice(OPERATORS) for _ in parts[1:]] + ['']
+        return '<mrow>%s</mrow>' % ''.join(p + o for p, o in zip(parts, ops))
+    if kind == 'sqrt':
+        return '<msqrt>%s</msqrt>' % synthetic_node(rng, size - 1, shape)
+    if kind == 'frac':
+        half = rng.randint(1, size - 1)
+        return '<mfrac>%s%s</mfrac>' % (synthetic_node(rng, half, shape),
+                                        synthetic_node(rng, size - half, shape))
+    tag = 'msub' if kind == 'sub' else 'msup'
+    script = rng.randint(1, min(size - 1, 3))
+    return '<mrow><%s>%s%s</%s>%s</mrow>' % (
+        tag, synthetic_node(rng, 1, shape), synthetic_node(rng, script, shape), tag,
+        ''.join('<mo>+</mo>' + synthetic_node(rng, size - 1 - script, shape)
+                for _ in range(size - 1 > script)))
+
+
+def synthetic_corpus(num_exprs, size=8, shape='mixed', per_document=100, seed=0):
+    """
+    Generate xhtml documents of random expressions, the same ones for the same arguments
+
+    :type num_exprs: int
+    :param num_exprs: number of expressions
+
+    :type size: int
+    :param size: mean number of leaves of an expression, sizes vary from half to one and a half
+        times it
+
+    :type shape: string
+    :param shape: key of SHAPES
+
+    :type per_document: int
+    :param per_document: number of expressions per document
+
+    :type seed: int
+    :param seed: seed of the random number generator
+
+    :rtype: list((string, string))
+    :return: name and content of each document
+    """
+    rng = Random(seed)
+    documents = []
+    for start in range(0, num_exprs, per_document):
+        maths = []
+        for i in range(start, min(start + per_document, num_exprs)):
+            leaves = rng.randint(max(size // 2, 1), max(size * 3 // 2, 1))
+            maths.append(MATHML % ('e%d' % i, synthetic_node(rng, leaves, shape)))
+        documents.append(('synthetic/doc%d.xhtml' % len(documents),
+                          '<html xmlns="http://www.w3.org/1999/xhtml"><body>\n<p>%s</p>\n'
+                          '</body></html>\n' % '</p>\n<p>'.join(maths)))
+    return documents
+
+
+def time_best(fn, repeat=3):
+    """
+    Return the best wall time of repeat calls of fn in seconds, and its last return value
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        ret = fn()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, ret
+
+
+def pairs(sizes):
+    """
+    Time pair generation for generated expressions of each size
+
+    :type sizes: list(int)
+    :param sizes: sizes of the generated expressions
+    """
+    print('%-8s %6s %10s %10s %12s %12s' % ('shape', 'size', 'symbols', 'pairs', 'list (ms)',
+                                            'stream (ms)'))
+    for name, generator in GENERATORS:
+        for size in sizes:
+            tree = generator(size)
+            num_symbols = sum(1 for _ in tree.get_symbols())
+            list_time, (pair_list, _) = time_best(lambda: tree.get_pairs(get_paths=True))
+            stream_time, num_pairs = time_best(lambda: sum(1 for _ in tree.iter_pairs()))
+            print('%-8s %6d %10d %10d %12.1f %12.1f' % (name, size, num_symbols, len(pair_list),
+                                                        list_time * 1000, stream_time * 1000))
+
+
+def parse_window(spec):
+    """
+    Parse a window written as max_dh[:max_depth], 'all' or empty values meaning no limit
+
+    :rtype: (int, int)
+    :return: pair window, None for all pairs
+    """
+    limits = [int(v) if v not in ('', 'all') else None for v in (spec.split(':') + [''])[:2]]
+    return tuple(limits) if any(v is not None for v in limits) else None
+
+
+def window(directory, windows, num_queries=100):
+    """
+    Build a segment of the collection for each pair window, and report its size and the latency of
+    searching for a sample of its own expressions
+
+    :type directory: string
+    :param directory: directory or file containing the collection
+
+    :type windows: list((int, int))
+    :param windows: pair windows to compare
+
+    :type num_queries: int
+    :param num_queries: number of expressions searched for
+    """
+    trees = list(SymbolTree.parse_directory(directory)[0])
+    queries = trees[::max(len(trees) // num_queries, 1)][:num_queries]
+    print('%-10s %10s %10s %10s %10s %10s' % ('window', 'postings', 'size (KB)', 'p50 (ms)',
+                                              'p95 (ms)', 'mean (ms)'))
+    fd, filename = tempfile.mkstemp(suffix='.seg')
+    os.close(fd)
+    try:
+        for w in windows:
+            writer = SegmentWriter(window=w)
+            writer.add_all(trees)
+            writer.write(filename)
+            index = SegmentIndex(filename, result_cache_size=0)
+            latencies = []
+            for query in queries:
+                start = time.time()
+                index.search(query)
+                latencies.append((time.time() - start) * 1000)
+            name = 'all' if w is None else ':'.join('all' if v is None else str(v) for v in w)
+            print('%-10s %10d %10.0f %10.2f %10.2f %10.2f' % (
+                name, len(index.exprs), os.path.getsize(filename) / 1024.0,
+                np.percentile(latencies, 50), np.percentile(latencies, 95), np.mean(latencies)))
+    finally:
+        os.remove(filename)
+
+
+def word(letters):
+    """
+    Return the symbols of a string of letters, one after the other
+    """
+    tree = SymbolTree(chain([Symbol(letter) for letter in letters], 'next'))
+    tree.document = 'word.mml'
+    return tree
+
+
+# Pairs of the query found in almost every expression get a negative idf, which also lowers the
+# result score of the expressions containing them. Exhaustive searches rank 'ab' below
+# 'accbzzzzzzzz' for 'abc', a pruned search trusting max_rank stops at 'ab'.
+PRUNE_COUNTEREXAMPLE = (['aabc', 'ab', 'accbzzzzzzzz', 'ca', 'cb', 'cczzzzzzzzzzzzzzzzzzzz'], 'abc')
+
+
+def compare_pruned(label, index, queries, ks):
+    """
+    Search for every query with and without pruning for every ranker that supports pruning, and
+    print the latency and number of mismatches of each ranker and k
+
+    :type label: string
+    :param label: printed before the name of the ranker
+
+    :type index: Index
+    :param index: index searched, its ranker is replaced
+
+    :type queries: list(SymbolTree)
+    :param queries: search trees
+
+    :type ks: list(int)
+    :param ks: numbers of results to compare
+
+    :rtype: int
+    :return: number of searches whose results differed
+    """
+    failures = 0
+    for ranker in all_rankers():
+        if not hasattr(ranker, 'max_rank'):
+            continue
+        index.ranker = ranker
+        for k in ks:
+            times = {False: 0, True: 0}
+            mismatches = 0
+            for query in queries:
+                results = {}
+                for pruned in (False, True):
+                    index.prune = pruned
+                    start = time.time()
+                    found = index.search(query, k)[0]
+                    times[pruned] += time.time() - start
+                    results[pruned] = [(r.expr_id, r.score) for r in found]
+                if results[False] != results[True]:
+                    if not mismatches:
+                        print('%s k=%d %s: exhaustive %r, pruned %r' % (
+                            ranker.__class__.__name__, k, query.latex or query.build_repr(),
+                            results[False][:3], results[True][:3]))
+                    mismatches += 1
+            failures += mismatches
+            print('%-28s %6d %12.2f %12.2f %10d' % (
+                label + ranker.__class__.__name__, k, times[False] * 1000 / len(queries),
+                times[True] * 1000 / len(queries), mismatches))
+    return failures
+
+
+def prune(directory, ks, num_queries=100):
+    """
+    Check that pruned searches return exactly the top results of exhaustive searches, and compare
+    their latency, for every ranker that supports pruning. The command exits with status 1 if any
+    search differs, so it can gate a release.
+
+    The collection is searched from a segment. PRUNE_COUNTEREXAMPLE is also searched from a
+    RedisIndex, pruning after every candidate.
+
+    :type directory: string
+    :param directory: directory or file containing the collection
+
+    :type ks: list(int)
+    :param ks: numbers of results to compare
+
+    :type num_queries: int
+    :param num_queries: number of expressions searched for
+
+    :rtype: int
+    :return: number of searches whose results differed
+    """
+    trees = list(SymbolTree.parse_directory(directory)[0])
+    queries = trees[::max(len(trees) // num_queries, 1)][:num_queries]
+    fd, filename = tempfile.mkstemp(suffix='.seg')
+    os.close(fd)
+    print('%-28s %6s %12s %12s %10s' % ('ranker', 'k', 'full (ms)', 'pruned (ms)', 'mismatches'))
+    try:
+        writer = SegmentWriter()
+        writer.add_all(trees)
+        writer.write(filename)
+        failures = compare_pruned('', SegmentIndex(filename, result_cache_size=0), queries, ks)
+    finally:
+        os.remove(filename)
+
+    words, query = PRUNE_COUNTEREXAMPLE
+    index = RedisIndex(result_cache_size=0, connection=MemoryRedis())
+    index.add_all([word(w) for w in words])
+    index.second_pass()
+    index.prune_batch = 1
+    failures += compare_pruned('%s/' % query, index, [word(query)], [1])
+    return failures
+
+
+def page_key(results, last_page):
+    """
+    Return what two indexes must agree on for a page of results: the scores, and the results
+    whose rank does not depend on how ties with expressions outside the page were broken
+    """
+    scores = [round(r.score, 9) for r in results]
+    inner = sorted((r.latex, round(r.score, 9), sorted(r.links)) for r in results
+                   if min(scores) < round(r.score, 9) and (last_page or round(r.score, 9) < max(scores)))
+    return scores, inner
+
+
+def shards(directory, num_shards=3, k=10, num_queries=100, urls=None):
+    """
+    Check that a sharded index returns the results of a single index over the same collection,
+    and compare their latency, for every ranker
+
+    :type directory: string
+    :param directory: directory or file containing the collection
+
+    :type num_shards: int
+    :param num_shards: number of in process shards, when no urls are given
+
+    :type k: int
+    :param k: number of results per search
+
+    :type num_queries: int
+    :param num_queries: number of expressions searched for
+
+    :type urls: list(str)
+    :param urls: redis urls of the shards, flushed before indexing, instead of MemoryRedis shards
+
+    :rtype: int
+    :return: number of searches whose results differed
+    """
+    trees = list(SymbolTree.parse_directory(directory)[0])
+    queries = trees[::max(len(trees) // num_queries, 1)][:num_queries]
+    single = RedisIndex(result_cache_size=0, connection=MemoryRedis())
+    single.add_all(trees)
+    single.second_pass()
+    if urls:
+        # Start from empty shards, indexes read some of their state when opened.
+        for shard in ShardedIndex.from_urls(urls, result_cache_size=0).shards:
+            shard.r.flushdb()
+        sharded = ShardedIndex.from_urls(urls, result_cache_size=0)
+    else:
+        sharded = ShardedIndex([MemoryRedis() for _ in range(num_shards)], result_cache_size=0)
+    sharded.add_all(trees)
+    sharded.second_pass()
+
+    failures = 0
+    print('%-20s %12s %12s %10s' % ('ranker', 'single (ms)', 'sharded (ms)', 'mismatches'))
+    for ranker in single.all_rankers:
+        indexes = [single.with_ranker(ranker), sharded.with_ranker(ranker)]
+        times = [0, 0]
+        mismatches = 0
+        for query in queries:
+            replies = []
+            for i, index in enumerate(indexes):
+                start = time.time()
+                replies.append(index.search(query, k))
+                times[i] += time.time() - start
+            (a, num_a, counts_a), (b, num_b, counts_b) = replies
+            mismatches += ((num_a, counts_a, bool(a)) != (num_b, counts_b, bool(b)) or
+                           bool(a) and page_key(a, len(a) < k) != page_key(b, len(b) < k))
+        failures += mismatches
+        print('%-20s %12.2f %12.2f %10d' % (ranker.__class__.__name__,
+                                            times[0] * 1000 / len(queries),
+                                            times[1] * 1000 / len(queries), mismatches))
+    return failures
+
+
+def corpus(directory, num_exprs, size=8, shape='mixed', per_document=100, seed=0):
+    """
+    Write a synthetic corpus to a directory, for use with indexer.py
+
+    See synthetic_corpus for the arguments.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for name, document in synthetic_corpus(num_exprs, size, shape, per_document, seed):
+        with open(os.path.join(directory, os.path.basename(name)), 'w') as f:
+            f.write(document)
+
+
+def latency_stats(latencies):
+    """
+    Return the percentiles of latencies in milliseconds
+
+    :rtype: dict(str,float)
+    """
+    return {'p50_ms': np.percentile(latencies, 50), 'p95_ms': np.percentile(latencies, 95),
+            'p99_ms': np.percentile(latencies, 99), 'mean_ms': np.mean(latencies)}
+
+
+def suite(num_exprs=5000, size=8, shape='mixed', seed=0, num_queries=100, batch_size=1000):
+    """
+    Index a synthetic corpus into a MemoryRedis and measure each stage, then the query latency of
+    every ranker
+
+    :type num_queries: int
+    :param num_queries: number of corpus expressions searched for with each ranker
+
+    :type batch_size: int
+    :param batch_size: number of expressions added per pipeline
+
+    See synthetic_corpus for the other arguments.
+
+    :rtype: dict
+    :return: parameters and measurements
+    """
+    report = {'params': {'exprs': num_exprs, 'size': size, 'shape': shape, 'seed': seed,
+                         'queries': num_queries, 'batch_size': batch_size},
+              'python': platform.python_version(), 'numpy': np.__version__}
+    documents = synthetic_corpus(num_exprs, size, shape, seed=seed)
+
+    start = time.time()
+    trees = []
+    for name, document in documents:
+        for tree in SymbolTree.iter_all_from_xml(StringIO.StringIO(document)):
+            tree.document = name
+            trees.append(tree)
+    elapsed = time.time() - start
+    megabytes = sum(len(document) for _, document in documents) / 1e6
+    report['parse'] = {'seconds': elapsed, 'exprs_per_sec': len(trees) / elapsed,
+                       'mb_per_sec': megabytes / elapsed}
+
+    index = RedisIndex(result_cache_size=0, connection=MemoryRedis())
+    start = time.time()
+    added = index.add_all(trees, batch_size=batch_size)
+    elapsed = time.time() - start
+    report['add'] = {'seconds': elapsed, 'exprs_per_sec': len(trees) / elapsed, 'new': added}
+
+    start = time.time()
+    index.second_pass()
+    report['second_pass'] = {'seconds': time.time() - start}
+
+    queries = trees[::max(len(trees) // num_queries, 1)][:num_queries]
+    report['search'] = {}
+    for ranker in index.all_rankers:
+        view = index.with_ranker(ranker)
+        latencies = []
+        for query in queries:
+            start = time.time()
+            view.search(query)
+            latencies.append((time.time() - start) * 1000)
+        report['search'][ranker.__class__.__name__] = latency_stats(latencies)
+    return report
+
+
+def print_report(report, baseline=None):
+    """
+    Print the measurements of a suite run, and their change from a baseline run if given
+    """
+    rows = [('parse exprs/sec', ('parse', 'exprs_per_sec')),
+            ('parse MB/sec', ('parse', 'mb_per_sec')),
+            ('add exprs/sec', ('add', 'exprs_per_sec')),
+            ('second_pass sec', ('second_pass', 'seconds'))]
+    for ranker in sorted(report['search']):
+        for stat in ('p50_ms', 'p95_ms', 'p99_ms'):
+            rows.append(('%s %s' % (ranker, stat), ('search', ranker, stat)))
+
+    if baseline is not None and baseline.get('params') != report['params']:
+        print('baseline ran with different parameters: %s' % baseline.get('params'))
+    print('%-30s %12s %12s %8s' % ('metric', 'value', 'baseline', 'change'))
+    for label, path in rows:
+        value = reduce(lambda d, key: d[key], path, report)
+        try:
+            old = reduce(lambda d, key: d[key], path, baseline)
+        except (KeyError, TypeError):
+            print('%-30s %12.2f' % (label, value))
+            continue
+        print('%-30s %12.2f %12.2f %+7.1f%%' % (label, value, old, (value - old) * 100.0 / old))
+
+
+def print_help_and_exit():
+    """
+    Prints usage statement
+    """
+    exit('Usage: python benchmark.py pairs [--sizes=N,N,..]\n'
+         '       python benchmark.py window [--windows=W,W,..] [--queries=N] <directory>\n'
+         '       python benchmark.py prune [--k=N,N,..] [--queries=N] <directory>\n'
+         '       python benchmark.py shards [--shards=N] [--urls=URL,URL,..] [--k=N] [--queries=N] <directory>\n'
+         '       python benchmark.py suite [--exprs=N] [--size=N] [--shape=S] [--seed=N] '
+         '[--queries=N] [--output=file.json] [--baseline=file.json]\n'
+         '       python benchmark.py corpus [--exprs=N] [--size=N] [--shape=S] [--seed=N] '
+         '[--per-document=N] <directory>')
+
+
+if __name__ == '__main__':
+
+    if len(argv) > 1:
+        options, args = parse_options(argv[2:])
+        if argv[1] == 'pairs':
+            pairs([int(s) for s in options.get('sizes', '10,100,300').split(',')])
+        elif argv[1] == 'window' and args:
+            windows = [parse_window(w) for w in options.get('windows', 'all,8,4,2,4:1').split(',')]
+            window(args[0], windows, num_queries=int(options.get('queries', 100)))
+        elif argv[1] == 'prune' and args:
+            ks = [int(k) for k in options.get('k', '1,10,100').split(',')]
+            if prune(args[0], ks, num_queries=int(options.get('queries', 100))):
+                exit('pruned searches differ from exhaustive searches')
+        elif argv[1] == 'shards' and args:
+            urls = options['urls'].split(',') if options.get('urls') else None
+            if shards(args[0], num_shards=int(options.get('shards', 3)), k=int(options.get('k', 10)),
+                      num_queries=int(options.get('queries', 100)), urls=urls):
+                exit('sharded searches differ from single index searches')
+        elif argv[1] in ('suite', 'corpus') and options.get('shape', 'mixed') not in SHAPES:
+            exit('shape must be one of %s' % ', '.join(sorted(SHAPES)))
+        elif argv[1] == 'suite':
+            report = suite(num_exprs=int(options.get('exprs', 5000)),
+                           size=int(options.get('size', 8)), shape=options.get('shape', 'mixed'),
+                           seed=int(options.get('seed', 0)),
+                           num_queries=int(options.get('queries', 100)))
+            baseline = None
+            if 'baseline' in options:
+                with open(options['baseline']) as f:
+                    baseline = json.load(f)
+            print_report(report, baseline)
+            if 'output' in options:
+                with open(options['output'], 'w') as f:
+                    json.dump(report, f, indent=2, sort_keys=True)
+        elif argv[1] == 'corpus' and args:
+            corpus(args[0], int(options.get('exprs', 10000)), size=int(options.get('size', 8)),
+                   shape=options.get('shape', 'mixed'),
+                   per_document=int(options.get('per_document', 100)),
+                   seed=int(options.get('seed', 0)))
+        else:
+            print_help_and_exit()
+    else:
+        print_help_and_exit()
@@ -38,6 +38,21 @@ class Config(object):
     DEBUG = True
     TESTING = True
     HOST = '0.0.0.0'
+    LATEXML_POOL_SIZE = 2  # number of latexmls daemons converting tex queries
+    LATEXML_TIMEOUT = 10  # seconds before a tex conversion is abandoned
+    TEX_CACHE_SIZE = 1000  # number of tex to mathml conversions kept in memory
+    TEX_CACHE_REDIS = False  # also share conversions between processes through redis
+    TEX_CACHE_DB = 15  # redis database of the shared conversions, apart from the index
+    TEX_CACHE_EXPIRE = 7 * 24 * 3600  # seconds conversions are kept in redis, None to keep them forever
+    NUM_RESULTS = 10  # results shown per page
+    MAX_RESULTS = 100  # largest page of results a request can ask for with k
+    MAX_LINKS = 10  # document links shown per result, None for all of them
+    RESULT_CACHE_SIZE = 1000  # number of ranked result pages kept in memory, 0 disables the cache
+    INDEX = 'redis'  # 'redis', 'segment' to serve SEGMENT_FILE without a redis server, or 'sharded'
+    SEGMENT_FILE = 'tangent.seg'  # segment file written by indexer.py segment
+    SHARDS = ['redis://localhost:6379/1', 'redis://localhost:6379/2']  # redis urls of a sharded index
+    MAX_IN_FLIGHT = 200  # requests served at once by serve.py
+    REDIS_MAX_CONNECTIONS = 50  # connections per redis database shared by the requests, None for no limit
 
 
 class FMeasureConfig(Config):
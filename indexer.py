@@ -29,45 +29,151 @@ Supports mathml,.xhtml and tex files
 """
 
 from sys import argv, exit
+from multiprocessing import cpu_count
 
 from werkzeug.utils import import_string
 
-from tangent import RedisIndex, SymbolTree
+from tangent import RedisIndex, SegmentWriter, ShardedIndex, SymbolTree
+from tangent.options import parse_options
 
 
-def index(directory):
+def open_index(shards=None, window=None):
+    """
+    Open the redis index, or a sharded index when shard urls are given
+
+    :type shards: list(str)
+    :param shards: redis url of each shard, such as redis://localhost:6380/0
+
+    :type window: (int, int)
+    :param window: maximum horizontal distance and nesting depth of the pairs of a new index
+
+    :rtype: RedisIndex or ShardedIndex
+    :return: index
+    """
+    if shards:
+        return ShardedIndex.from_urls(shards, window=window)
+    return RedisIndex(window=window)
+
+
+def connections(index):
+    """
+    Return the redis client of each shard of an index opened by open_index
+    """
+    return [shard.r for shard in index.shards] if isinstance(index, ShardedIndex) else [index.r]
+
+
+def index(directory, batch_size=1000, processes=1, window=None, shards=None):
     """
     Index a directory containing .text,'.xhtml', '.mathml', '.mml' files
 
+    :type batch_size: int
+    :param batch_size: number of expressions written to redis per pipeline
+
+    :type processes: int
+    :param processes: number of processes parsing files in parallel
+
+    :type window: (int, int)
+    :param window: maximum horizontal distance and nesting depth of the pairs of a new index
+
+    :type shards: list(str)
+    :param shards: redis url of each shard of a sharded index
+
     """
-    trees, stats = SymbolTree.parse_directory(directory)
-    index = RedisIndex()
-    index.add_all(trees)
+    index = open_index(shards, window)
+    trees, stats = SymbolTree.parse_directory(directory, processes=processes, window=index.window)
+    num_added = index.add_all(trees, batch_size=batch_size)
     index.second_pass()
 
     print('')
-    print('Added %d expressions from %d documents' % (stats['num_expressions'],
-                                                      stats['num_documents']))
+    print('Added %d expressions (%d new) from %d documents' % (stats['num_expressions'], num_added,
+                                                               stats['num_documents']))
     print('Missing tags:')
     for tag, count in stats['missing_tags'].most_common():
         print('    %s (%d)' % (tag, count))
 
 
-def second_pass():
+def segment(filename, directories, processes=1, window=None):
+    """
+    Build a segment file, served by SegmentIndex, from the expressions of the directories
+
+    :type filename: string
+    :param filename: segment file to write
+
+    :type directories: list(string)
+    :param directories: directories or files to index
+
+    :type processes: int
+    :param processes: number of processes parsing files in parallel
+
+    :type window: (int, int)
+    :param window: maximum horizontal distance and nesting depth of the pairs
+    """
+    writer = SegmentWriter(window=window)
+    num_expressions = 0
+    num_added = 0
+    for directory in directories:
+        trees, stats = SymbolTree.parse_directory(directory, processes=processes, window=window)
+        num_added += writer.add_all(trees)
+        num_expressions += stats['num_expressions']
+    writer.write(filename)
+    print('Wrote %d expressions (%d distinct) to %s' % (num_expressions, num_added, filename))
+
+
+def second_pass(mode='full', max_growth=0.1, shards=None):
     """
     Perform secondary operations as defined by index
+
+    :type mode: string
+    :param mode: 'full' to rescore every expression, 'incremental' to rescore only the new
+        expressions and the ones containing pairs whose weight changed since the last pass
+
+    :type max_growth: float
+    :param max_growth: growth of the index since the last full pass above which an incremental
+        pass rescores every expression anyway
+
+    :type shards: list(str)
+    :param shards: redis url of each shard of a sharded index, whose passes are always full
     """
-    index = RedisIndex()
-    index.second_pass()
+    if mode not in ('full', 'incremental'):
+        print_help_and_exit()
+    index = open_index(shards)
+    full = index.second_pass(incremental=mode == 'incremental', max_growth=max_growth)
+    rescored = sum(int(r.hget('second_pass', 'rescored') or 0) for r in connections(index))
+    print('%s second pass rescored %d expressions' % ('Full' if full else 'Incremental', rescored))
+
 
+def flush(shards=None):
+    """
+    Empty the redis database, or every shard of a sharded index
 
-def flush():
+    :type shards: list(str)
+    :param shards: redis url of each shard of a sharded index
     """
-    Empty the redis database
+
+    for r in connections(open_index(shards)):
+        # Keep the generation increasing so running servers never reuse cached results.
+        generation = int(r.get('index_generation') or 0)
+        r.flushdb()
+        r.set('index_generation', generation + 1)
+
+
+def pair_window(options):
     """
+    Return the pair window set by the --max-dh and --max-depth options, or None for all pairs
 
-    index = RedisIndex()
-    index.r.flushdb()
+    :rtype: (int, int)
+    :return: maximum horizontal distance and nesting depth, None where not set
+    """
+    if 'max_dh' not in options and 'max_depth' not in options:
+        return None
+    return tuple(int(options[name]) if name in options else None for name in ['max_dh', 'max_depth'])
+
+
+def shard_urls(options):
+    """
+    Return the shard urls set by the --shards option, or None for a single redis index
+    """
+    return options['shards'].split(',') if options.get('shards') else None
 
 
 def print_help_and_exit():
@@ -75,7 +181,9 @@ def print_help_and_exit():
     Prints usage statement
     """
 
-    exit('Usage: python index.py {index|second_pass|flush} <directory> [<directory2> ..]')
+    exit('Usage: python index.py {index|flush} [--batch-size=N] [--processes=N] [--max-dh=N] [--max-depth=N] [--shards=URL,URL,..] <directory> [<directory2> ..]\n'
+         '       python index.py second_pass [--mode=full|incremental] [--max-growth=F] [--shards=URL,URL,..]\n'
+         '       python index.py segment [--processes=N] [--max-dh=N] [--max-depth=N] <file> <directory> [<directory2> ..]')
 
 
 if __name__ == '__main__':
@@ -83,12 +191,25 @@ if __name__ == '__main__':
     if len(argv) > 1:
 
         if argv[1] == 'index':
-            for directory in argv[2:]:
-                index(directory)
+            options, directories = parse_options(argv[2:])
+            for directory in directories:
+                index(directory, batch_size=int(options.get('batch_size', 1000)),
+                      processes=int(options.get('processes', cpu_count())),
+                      window=pair_window(options), shards=shard_urls(options))
+        elif argv[1] == 'segment':
+            options, args = parse_options(argv[2:])
+            if len(args) < 2:
+                print_help_and_exit()
+            segment(args[0], args[1:], processes=int(options.get('processes', cpu_count())),
+                    window=pair_window(options))
         elif argv[1] == 'second_pass':
-            second_pass()
+            options, _ = parse_options(argv[2:])
+            second_pass(mode=options.get('mode', 'full'),
+                        max_growth=float(options.get('max_growth', 0.1)),
+                        shards=shard_urls(options))
         elif argv[1] == 'flush':
-            flush()
+            options, _ = parse_options(argv[2:])
+            flush(shards=shard_urls(options))
         else:
             print_help_and_exit()
     else:
@@ -27,8 +27,11 @@ Tangent web app is a Flask based App
 
 Below are the routes and appropriates actions
 
-/query=?: query page if query else home page
+/query=?: query page if query else home page, k=? and offset=? select the page of results, k is
+    capped at MAX_RESULTS and malformed or negative values are a 400 Bad Request
 /random : retrieve a random expression and query
+/cache : tex conversion and search result cache counters
+/metrics : search stage timings, counters and cache statistics in the Prometheus text format
 
 """
 
@@ -40,9 +43,10 @@ from operator import itemgetter
 import urlparse
 import urllib
 
-from flask import Flask, render_template, request, make_response
+import redis
+from flask import Flask, render_template, request, make_response, jsonify, Response, abort
 
-from tangent import SymbolTree, RedisIndex
+from tangent import SymbolTree, RedisIndex, SegmentIndex, ShardedIndex, LatexmlPool, TexCache, Metrics
 
 app = Flask(__name__)
 if len(argv) > 1:
@@ -53,7 +57,30 @@ else:
     print('Couldn\'t load config file')
     exit(0)
 
-index = RedisIndex(db=app.config['DATABASE'], ranker=app.config['RANKER'])
+if app.config['INDEX'] == 'segment':
+    index = SegmentIndex(app.config['SEGMENT_FILE'], ranker=app.config['RANKER'],
+                         result_cache_size=app.config['RESULT_CACHE_SIZE'])
+elif app.config['INDEX'] == 'sharded':
+    index = ShardedIndex.from_urls(app.config['SHARDS'], ranker=app.config['RANKER'],
+                                   result_cache_size=app.config['RESULT_CACHE_SIZE'],
+                                   max_connections=app.config['REDIS_MAX_CONNECTIONS'])
+else:
+    index = RedisIndex(db=app.config['DATABASE'], ranker=app.config['RANKER'],
+                       result_cache_size=app.config['RESULT_CACHE_SIZE'],
+                       max_connections=app.config['REDIS_MAX_CONNECTIONS'])
+index.max_links = app.config['MAX_LINKS']
+index.metrics = metrics = Metrics()
+metrics.describe('tangent_query_parse_seconds', 'Time to convert and parse the queries')
+SymbolTree.converter = LatexmlPool(size=app.config['LATEXML_POOL_SIZE'], timeout=app.config['LATEXML_TIMEOUT'])
+if not app.config['TEX_CACHE_REDIS']:
+    tex_db = None
+elif app.config['REDIS_MAX_CONNECTIONS']:
+    tex_db = redis.StrictRedis(connection_pool=redis.BlockingConnectionPool(
+        db=app.config['TEX_CACHE_DB'], max_connections=app.config['REDIS_MAX_CONNECTIONS']))
+else:
+    tex_db = redis.StrictRedis(db=app.config['TEX_CACHE_DB'])
+SymbolTree.tex_cache = TexCache(size=app.config['TEX_CACHE_SIZE'], db=tex_db,
+                                expire=app.config['TEX_CACHE_EXPIRE'])
 
 
 def time_it(fn, *args):
@@ -90,6 +117,29 @@ def stats():
     return render_template('stats.html', stats=index.stats())
 
 
+@app.route('/cache')
+def cache_stats():
+    """
+    Hit and miss counters of the tex conversion and search result caches
+    """
+    return jsonify(tex_cache=SymbolTree.tex_cache.stats(),
+                   result_cache=index.result_cache.stats() if index.result_cache else None)
+
+
+@app.route('/metrics')
+def metrics_page():
+    """
+    Search metrics and cache statistics in the Prometheus text format
+    """
+    caches = [('tex', SymbolTree.tex_cache.stats())]
+    if index.result_cache:
+        caches.append(('result', index.result_cache.stats()))
+    for cache, stats in caches:
+        for name, value in stats.items():
+            metrics.set('tangent_cache_%s' % name, (('cache', cache),), value)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/list')
 def list_all():
     """
@@ -100,6 +150,20 @@ def list_all():
     return render_template('list.html', expressions=expressions)
 
 
+def int_arg(name, default, minimum=0):
+    """
+    Return an integer request argument, aborting with 400 Bad Request if it is malformed or
+    below minimum
+    """
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        abort(400)
+    if value < minimum:
+        abort(400)
+    return value
+
+
 def home():
     """
     Home page
@@ -115,19 +179,24 @@ def query(query_expr):
     :param query_expr: query expression in tex and mathml
     """
     debug = 'debug' in request.args and request.args['debug'] == 'true'
+    k = min(int_arg('k', app.config['NUM_RESULTS'], minimum=1), app.config['MAX_RESULTS'])
+    offset = int_arg('offset', 0)
     is_mathml = '<math' in query_expr
     if is_mathml:
         parse_time, tree = time_it(lambda f: SymbolTree.parse_from_mathml_string(f), query_expr)
     else:
         parse_time, tree = time_it(SymbolTree.parse_from_tex, query_expr)
-    search_time, (results, num_results, pair_counts) = time_it(lambda: list(index.search(tree)))
+    metrics.observe('tangent_query_parse_seconds', (('format', 'mathml' if is_mathml else 'tex'),),
+                    parse_time / 1000)
+    search_time, (results, num_results, pair_counts) = time_it(lambda: list(index.search(tree, k, offset)))
     pair_count_str = u''
 
     #sort results by expression that share the most pair counts
     for p, c in sorted(pair_counts.items(), reverse=True, key=itemgetter(1)):
         pair_count_str += u'%s: %d, ' % (p, c)
     return render_template('results.html', query=query_expr, results=results, num_results=num_results,
-                           pair_counts=pair_count_str, parse_time=parse_time, search_time=search_time, debug=debug)
+                           pair_counts=pair_count_str, parse_time=parse_time, search_time=search_time, debug=debug,
+                           k=k, offset=offset)
 
 
 def query_mathml(query_expr):
@@ -139,12 +208,13 @@ def query_mathml(query_expr):
 
     """
     parse_time, tree = time_it(lambda f: SymbolTree.parse_all_from_xml(f)[0], query_expr)
-    search_time, (results, num_results, pair_counts) = time_it(lambda: list(index.search(tree)))
+    search_time, (results, num_results, pair_counts) = time_it(lambda: list(index.search(tree, app.config['NUM_RESULTS'])))
     pair_count_str = u''
     for p, c in sorted(pair_counts.items(), reverse=True, key=itemgetter(1)):
         pair_count_str += u'%s: %d, ' % (p, c)
     return render_template('results.html', query='', results=results, num_results=num_results,
-                           pair_counts=pair_count_str, parse_time=parse_time, search_time=search_time)
+                           pair_counts=pair_count_str, parse_time=parse_time, search_time=search_time,
+                           k=app.config['NUM_RESULTS'], offset=0)
 
 
 @app.route('/random')
@@ -21,34 +21,96 @@
         - David Stalnaker: david.stalnaker@gmail.com
         - Richard Zanibbi: rlaz@cs.rit.edu
 """
-
 """
     Console Script that can be used to query the index
 
+    The batch mode reads queries as JSON Lines and writes one JSON line per query and config as
+    soon as it is answered.
 """
 
-from sys import argv, exit, stdin
+from sys import argv, exit, stdin, stdout
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 import json
+import time
 
 from werkzeug.utils import import_string
 
-from tangent import RedisIndex, SymbolTree
+from tangent import RedisIndex, SegmentIndex, ShardedIndex, SymbolTree, LatexmlPool, TexCache
+from tangent.options import parse_options, int_option
+
+# (config name, index) pairs searched by each batch worker.
+searchers = None
+
+
+def open_index(config):
+    """
+    Open the index selected by the config object
+
+    :type config: Config
+    :param config: Config object
+
+    :rtype: Index
+    :return: redis, segment or sharded index
+    """
+    if config.INDEX == 'segment':
+        return SegmentIndex(config.SEGMENT_FILE, ranker=config.RANKER)
+    if config.INDEX == 'sharded':
+        return ShardedIndex.from_urls(config.SHARDS, ranker=config.RANKER)
+    return RedisIndex(db=config.DATABASE, ranker=config.RANKER)
+
+
+def open_searchers(config_names):
+    """
+    Open an index for each config, configs reading the same index share it with their own ranker
+
+    :type config_names: list(str)
+    :param config_names: import names of the config objects
+
+    :rtype: list((str, Index))
+    :return: config name and index of each config
+    """
+    stores = {}
+    indexes = []
+    for name in config_names:
+        config = import_string(name)
+        store = (config.INDEX, {'segment': config.SEGMENT_FILE,
+                                'sharded': tuple(config.SHARDS)}.get(config.INDEX, config.DATABASE))
+        if store not in stores:
+            stores[store] = open_index(config)
+        indexes.append((name, stores[store].with_ranker(config.RANKER)))
+    return indexes
 
 
-def search(config, query):
+def init_worker(config_names):
+    """
+    Open the indexes of a batch worker process
     """
+    global searchers
+    searchers = open_searchers(config_names)
 
-    Search the redis index for the given latex expression
+
+def search(config, query, k=10, index=None):
+    """
+
+    Search the index for the given latex expression
 
     :type config: Config
     :param config: Config object
 
+    :type k: int
+    :param k: number of results to return
+
+    :type index: Index
+    :param index: index to search, opened from the config if not given
+
     :rtype: dict
     :return: Dictionary containing "system". "query", "results"
 
     """
-    index = RedisIndex(db=config.DATABASE, ranker=config.RANKER)
-    results, _, _ = index.search_tex(query)
+    if index is None:
+        index = open_index(config)
+    results, _, _ = index.search_tex(query, k)
     return {
         'system': 'Tangent',
         'query': query,
@@ -56,11 +118,106 @@ def search(config, query):
     }
 
 
+def parse_query(query):
+    """
+    Parse a tex or mathml query into a symbol tree
+    """
+    if '<math' in query:
+        return SymbolTree.parse_from_mathml_string(query)
+    return SymbolTree.parse_from_tex(query)
+
+
+def search_all(task):
+    """
+    Search for one query with every config of the worker
+
+    :type task: (int, str, int, int)
+    :param task: line number, JSON line of the query, default and maximum number of results
+
+    :rtype: list(dict)
+    :return: one record per config, or a single record describing the error
+    """
+    line_number, line, k, max_results = task
+    try:
+        query = json.loads(line)
+        if not isinstance(query, dict):
+            query = {'query': query}
+        query_id = query.get('id', line_number)
+        k = int_option(query.get('k', k), minimum=1)
+        if k is None:
+            raise ValueError('k must be a positive integer')
+        k = min(k, max_results)
+        start = time.time()
+        tree = parse_query(query['query'])
+        parse_ms = (time.time() - start) * 1000
+    except Exception as e:
+        return [{'id': line_number, 'error': 'invalid query: %s' % e}]
+
+    records = []
+    for name, index in searchers:
+        record = {'id': query_id, 'config': name, 'query': query['query'], 'parse_ms': parse_ms}
+        try:
+            start = time.time()
+            results, num_matches, _ = index.search(tree, k)
+            record['search_ms'] = (time.time() - start) * 1000
+            record['num_matches'] = num_matches
+            record['results'] = [{'latex': r.latex, 'score': r.score, 'expr_id': r.expr_id}
+                                 for r in results]
+        except Exception as e:
+            record['error'] = str(e)
+        records.append(record)
+    return records
+
+
+def batch(config_names, lines, k=10, workers=1, processes=False, max_results=100):
+    """
+    Search for every query with every config, printing one JSON line per query and config in the
+    order the queries complete
+
+    :type config_names: list(str)
+    :param config_names: import names of the config objects
+
+    :type lines: iterable(str)
+    :param lines: JSON lines holding a query string, or an object with "query" and optionally
+        "id" and "k"
+
+    :type k: int
+    :param k: number of results of queries that do not set "k"
+
+    :type workers: int
+    :param workers: number of queries searched in parallel
+
+    :type processes: bool
+    :param processes: use worker processes, each with its own indexes, instead of threads
+
+    :type max_results: int
+    :param max_results: largest number of results a query can ask for
+    """
+    global searchers
+    if processes:
+        pool = Pool(workers, initializer=init_worker, initargs=(config_names,))
+    else:
+        searchers = open_searchers(config_names)
+        pool = ThreadPool(workers)
+    tasks = ((i, line, k, max_results) for i, line in enumerate(lines, 1) if line.strip())
+    try:
+        for records in pool.imap_unordered(search_all, tasks):
+            for record in records:
+                stdout.write(json.dumps(record) + '\n')
+            stdout.flush()
+    finally:
+        pool.close()
+        pool.join()
+
+
 def print_help_and_exit():
     """
     Prints Usage
     """
-    exit('Usage: python search.py config_object query [query2, ...]')
+    exit('Usage: python search.py config_object [-k num_results] query [query2, ...]\n'
+         '       num_results and --k are at least 1, and capped at MAX_RESULTS of the config\n'
+         '       python search.py batch config_object[,config_object,..] [--k=N] [--workers=N] '
+         '[--pool=thread|process] [queries.jsonl]')
 
 
 if __name__ == '__main__':
@@ -68,13 +225,40 @@ if __name__ == '__main__':
     if len(argv) > 1:
         if argv[1] == 'help':
             print_help_and_exit()
-        if len(argv) == 2:  #only one query
-            config = import_string(argv[1])
-            results = [search(config, query.strip()) for query in stdin.readlines()]
+        if argv[1] == 'batch':
+            options, args = parse_options(argv[2:])
+            if not args or options.get('pool', 'thread') not in ('thread', 'process'):
+                print_help_and_exit()
+            config_names = args[0].split(',')
+            config = import_string(config_names[0])
+            workers = int_option(options.get('workers', 1), minimum=1)
+            k = int_option(options.get('k', config.NUM_RESULTS), minimum=1)
+            if workers is None or k is None:
+                print_help_and_exit()
+            SymbolTree.converter = LatexmlPool(size=max(config.LATEXML_POOL_SIZE, workers),
+                                               timeout=config.LATEXML_TIMEOUT)
+            SymbolTree.tex_cache = TexCache(size=config.TEX_CACHE_SIZE)
+            lines = open(args[1]) if len(args) > 1 else stdin
+            batch(config_names, lines, k=min(k, config.MAX_RESULTS), workers=workers,
+                  processes=options.get('pool') == 'process', max_results=config.MAX_RESULTS)
+            exit(0)
+        config = import_string(argv[1])
+        queries = argv[2:]
+        k = config.NUM_RESULTS
+        if queries[:1] == ['-k']:
+            k = int_option(queries[1], minimum=1) if len(queries) > 1 else None
+            if k is None:
+                print_help_and_exit()
+            queries = queries[2:]
+        k = min(k, config.MAX_RESULTS)
+        SymbolTree.converter = LatexmlPool(size=config.LATEXML_POOL_SIZE, timeout=config.LATEXML_TIMEOUT)
+        SymbolTree.tex_cache = TexCache(size=config.TEX_CACHE_SIZE)
+        index = open_index(config)
+        if not queries:  #read queries from stdin
+            results = [search(config, query.strip(), k, index) for query in stdin.readlines()]
             print(json.dumps(results))
         else:  #multiple queries parsed
-            config = import_string(argv[1])
-            results = [search(config, query.strip()) for query in argv[2:]]
+            results = [search(config, query.strip(), k, index) for query in queries]
             print(json.dumps(results))
     else:
         print_help_and_exit()
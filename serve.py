@@ -0,0 +1,101 @@
+"""
+    Tangent
+    Copyright (c) 2013 David Stalnaker, Richard Zanibbi
+
+    This file is part of Tangent.
+
+    Tanget is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Tangent is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Tangent.  If not, see <http://www.gnu.org/licenses/>.
+
+    Contact:
+        - David Stalnaker: david.stalnaker@gmail.com
+        - Richard Zanibbi: rlaz@cs.rit.edu
+"""
+
+"""
+Serve the Tangent web app with many queries in flight in one process
+
+This is a threaded server: every request gets its own thread, at most MAX_IN_FLIGHT at once.
+The requests share REDIS_MAX_CONNECTIONS connections per redis database and the
+LATEXML_POOL_SIZE tex converters, and block their thread while they wait on them.
+"""
+
+import threading
+from sys import argv, exit
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer as SimpleWSGIServer, WSGIRequestHandler
+
+
+class ThreadingWSGIServer(ThreadingMixIn, SimpleWSGIServer):
+    """
+    WSGI server handling each request in its own thread, at most max_in_flight at once
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, max_in_flight=200):
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        SimpleWSGIServer.__init__(self, address, WSGIRequestHandler)
+
+    def process_request(self, request, client_address):
+        # Further connections wait in the listen backlog while all the slots are taken.
+        self.slots.acquire()
+        try:
+            ThreadingMixIn.process_request(self, request, client_address)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            self.slots.release()
+
+
+def serve(app, host, port, max_in_flight=200):
+    """
+    Serve a WSGI app until interrupted
+
+    :type app: Flask
+    :param app: WSGI application
+
+    :type host: string
+    :param host: address to listen on
+
+    :type port: int
+    :param port: port to listen on
+
+    :type max_in_flight: int
+    :param max_in_flight: maximum number of requests served at once
+    """
+    server = ThreadingWSGIServer((host, port), max_in_flight)
+    server.set_app(app)
+    print('Serving on http://%s:%d, at most %d requests at once' % (host, port, max_in_flight))
+    server.serve_forever()
+
+
+def print_help_and_exit():
+    """
+    Usage
+    """
+    exit('Usage: python serve.py config_object')
+
+
+if __name__ == '__main__':
+    if len(argv) < 2 or argv[1] == 'help':
+        print_help_and_exit()
+
+    # The app loads the config object named on the command line.
+    from mathsearch import app
+    serve(app, app.config['HOST'], int(app.config['PORT']), int(app.config['MAX_IN_FLIGHT']))
@@ -22,7 +22,15 @@
         - Richard Zanibbi: rlaz@cs.rit.edu
 """
 
-from symboltree import SymbolTree
+from latexmlpool import LatexmlPool, LatexmlError
+from cache import LRUCache, TexCache
+from pairdictionary import PairDictionary, pair_fields
+from pairfrequencies import PairFrequencies
+from bloomfilter import BloomFilter
+from postings import encode_postings, decode_postings, count_postings
+from secondpass import SecondPass
+from metrics import Metrics, StageTimer
+from symboltree import SymbolTree, Symbol
 from fmeasureranker import FMeasureRanker
 from distanceranker import DistanceRanker
 from prefixranker import PrefixRanker
@@ -30,7 +38,10 @@ from recallranker import RecallRanker
 from tfidfranker import TfIdfRanker
 from everythingranker import EverythingRanker
 from tfidfprefixranker import TfIdfPrefixRanker
-from index import Index, Result
+from index import Index, Result, all_rankers
+from memoryredis import MemoryRedis
 from redisindex import RedisIndex
+from segmentindex import SegmentIndex, SegmentWriter
+from shardedindex import ShardedIndex
 
-__all__ = ['SymbolTree', 'Index', 'Result', 'RedisIndex', 'FMeasureRanker', 'DistanceRanker', 'RecallRanker', 'PrefixRanker', 'PrefixRanker', 'TfIdfPrefixRanker']
+__all__ = ['LatexmlPool', 'LatexmlError', 'LRUCache', 'TexCache', 'PairDictionary', 'PairFrequencies', 'BloomFilter', 'encode_postings', 'decode_postings', 'count_postings', 'SecondPass', 'Metrics', 'StageTimer', 'SymbolTree', 'Symbol', 'Index', 'Result', 'all_rankers', 'MemoryRedis', 'RedisIndex', 'SegmentIndex', 'SegmentWriter', 'ShardedIndex', 'FMeasureRanker', 'DistanceRanker', 'RecallRanker', 'PrefixRanker', 'PrefixRanker', 'TfIdfPrefixRanker']
@@ -0,0 +1,93 @@
+"""
+    Tangent
+    Copyright (c) 2013 David Stalnaker, Richard Zanibbi
+
+    This file is part of Tangent.
+
+    Tanget is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Tangent is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Tangent.  If not, see <http://www.gnu.org/licenses/>.
+
+    Contact:
+        - David Stalnaker: david.stalnaker@gmail.com
+        - Richard Zanibbi: rlaz@cs.rit.edu
+"""
+
+"""
+Bloom filter over tree fingerprints, used by the bulk indexer to skip exact search lookups
+
+A tree fingerprint is already a uniformly distributed 128 bit digest, so the bit positions are
+derived from its two 64 bit halves by double hashing instead of hashing it again.
+"""
+
+import math
+
+import numpy as np
+
+
+class BloomFilter(object):
+    """
+    Set of fingerprints answering membership with false positives but no false negatives
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        """
+        :type capacity: int
+        :param capacity: number of fingerprints the filter is sized for; more can be added at the
+            cost of a higher false positive rate
+
+        :type error_rate: float
+        :param error_rate: false positive rate at capacity
+        """
+        capacity = max(1, capacity)
+        self.num_bits = max(64, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(float(self.num_bits) / capacity * math.log(2))))
+        self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def positions(self, fingerprints):
+        """
+        Return the bit positions of each fingerprint, one row per fingerprint
+        """
+        halves = np.frombuffer(''.join(fingerprints), dtype='<u8').reshape(-1, 2)
+        steps = np.arange(self.num_hashes, dtype=np.uint64)
+        # Unsigned arithmetic wraps around, which is fine for hashing.
+        return (halves[:, :1] + steps * (halves[:, 1:] | 1)) % np.uint64(self.num_bits)
+
+    def add(self, fingerprints):
+        """
+        Add fingerprints to the filter
+
+        :type fingerprints: list(str)
+        :param fingerprints: 16 byte fingerprints
+        """
+        if not fingerprints:
+            return
+        positions = self.positions(fingerprints).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3),
+                         np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+        self.count += len(fingerprints)
+
+    def contains(self, fingerprints):
+        """
+        Return whether each fingerprint may have been added
+
+        :type fingerprints: list(str)
+        :param fingerprints: 16 byte fingerprints
+
+        :rtype: list(bool)
+        :return: False for the fingerprints that were certainly never added
+        """
+        if not fingerprints:
+            return []
+        positions = self.positions(fingerprints)
+        bits = (self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return bits.all(axis=1).tolist()
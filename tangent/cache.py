@@ -0,0 +1,138 @@
+"""
+    Tangent
+    Copyright (c) 2013 David Stalnaker, Richard Zanibbi
+
+    This file is part of Tangent.
+
+    Tanget is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Tangent is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Tangent.  If not, see <http://www.gnu.org/licenses/>.
+
+    Contact:
+        - David Stalnaker: david.stalnaker@gmail.com
+        - Richard Zanibbi: rlaz@cs.rit.edu
+"""
+
+"""
+Bounded caches used to skip repeated work when serving queries
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Thread safe least recently used cache with hit and miss counters
+    """
+    def __init__(self, size=1000):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Return the cached value for key, or None if it is not cached
+        """
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            # Re-insert so the entry becomes the most recently used.
+            self.entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Cache value under key, evicting the least recently used entry if full
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Return the size and counters of the cache
+
+        :rtype: dict
+        :return: dictionary of cache statistics
+        """
+        return {
+            'size': len(self.entries),
+            'capacity': self.size,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+class TexCache(LRUCache):
+    """
+    Cache from whitespace normalized tex to the presentation mathml produced by LaTeXML
+
+    When a redis connection is given, conversions are also stored in redis so they are shared
+    between processes and survive restarts. They expire from redis after expire seconds, so the
+    database does not grow with every query ever converted, unless expire is None.
+    """
+    key_format = u'latexml:%s'
+
+    def __init__(self, size=1000, db=None, expire=None):
+        LRUCache.__init__(self, size)
+        self.db = db
+        self.expire = expire
+        self.db_hits = 0
+
+    @staticmethod
+    def normalize(tex):
+        """
+        Collapse all runs of whitespace so trivially different queries share an entry
+        """
+        if isinstance(tex, str):
+            tex = tex.decode('utf-8')
+        return u' '.join(tex.split())
+
+    def get(self, tex):
+        """
+        Return the cached mathml for tex, or None if it has not been converted yet
+        """
+        key = self.normalize(tex)
+        mathml = LRUCache.get(self, key)
+        if mathml is None and self.db is not None:
+            mathml = self.db.get(self.key_format % key)
+            if mathml is not None:
+                self.db_hits += 1
+                LRUCache.put(self, key, mathml)
+        return mathml
+
+    def put(self, tex, mathml):
+        # Failed conversions are not remembered, they would be served to every later query.
+        if not mathml or not mathml.strip():
+            return
+        key = self.normalize(tex)
+        LRUCache.put(self, key, mathml)
+        if self.db is not None:
+            self.db.set(self.key_format % key, mathml, ex=self.expire)
+
+    def stats(self):
+        stats = LRUCache.stats(self)
+        stats['db_hits'] = self.db_hits
+        return stats
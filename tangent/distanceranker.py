@@ -35,29 +35,32 @@ class DistanceRanker(object):
    """
 
     @staticmethod
-    def search_score(search_pairs, pair_counts=None, total_exprs=None):
+    def search_score(search_pairs, pair_counts=None, total_exprs=None, distances=None):
         """
         Maximum score for search pairs is the sum of 1/horizontal distance
 
         :type search_pairs: list
-        :param search_pairs: list of symbol pairs
+        :param search_pairs: list of symbol pair ids
+
+        :type distances: dict(int,int)
+        :param distances: horizontal distance of each symbol pair
 
         :rtype: double
         :return: max score for this expression
 
         """
-        return sum(1 / int(pair.split('|')[2]) for pair in search_pairs)
+        return sum(1 / distances[pair] for pair in search_pairs)
 
     result_score_key = 'distance_score'
     fetch_paths = False
 
     @staticmethod
-    def rank(match_pairs, search_score, result_score, pair_counts, total_exprs, search_paths):
+    def rank(match_pairs, search_score, result_score, pair_counts, total_exprs, search_paths, distances=None):
         """
         Returns distance based score
 
         :type match_pairs: list
-        :param match_pairs list of pairs that latched
+        :param match_pairs list of pair ids that latched
 
         :type search_score: double
         :param search_score: score for pairs in query
@@ -66,18 +69,42 @@ class DistanceRanker(object):
         :param result_score: score for pairs that matched
 
 
-        :type pair_counts: dict(str,int)
+        :type pair_counts: dict(int,int)
         :param pair_counts: frequency for each symbol pair
 
         :type total_exprs:
         :param total_exprs:
 
-        :type search_paths:dict(str,list)
+        :type search_paths:dict(int,list)
         :param: search_paths:given two symbol pairs, the path between them
 
+        :type distances: dict(int,int)
+        :param distances: horizontal distance of each symbol pair
+
         :rtype: double
         :return: distance score
 
         """
-        match_score = sum(1 / int(pair.split('|')[2]) for pair in match_pairs)
+        match_score = sum(1 / distances[pair] for pair in match_pairs)
         return 2 * match_score / (search_score + result_score)
+
+    @staticmethod
+    def match_weights(search_pairs, pair_counts, total_exprs, distances=None):
+        """
+        Every matched pair adds 1 / its horizontal distance to the match score m
+        """
+        return dict((pair, 1 / distances[pair]) for pair in search_pairs)
+
+    @staticmethod
+    def rank_scores(match_scores, search_score, result_scores):
+        """
+        Distance weighted f-measure 2m / (s + r) of each candidate
+        """
+        return 2 * match_scores / (search_score + result_scores)
+
+    @staticmethod
+    def max_rank(match_score, search_score):
+        """
+        Bound 2m / (s + m), as the result score r of a candidate is at least m
+        """
+        return 2 * match_score / (search_score + match_score)
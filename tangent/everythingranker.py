@@ -27,6 +27,8 @@ from math import log
 from collections import deque, Counter, defaultdict
 from itertools import izip_longest, izip
 
+import numpy as np
+
 def prefix(search_path, result_path):
     i = 0
     try:
@@ -42,21 +44,18 @@ def prefix(search_path, result_path):
 def idf(count, total):
     return log(total / (count + 1), 10)
 
-def distance(pair):
-    return int(pair.split('|')[2])
-
 class EverythingRanker(object):
     """
     The EverythingRanker is another scorer that considers distance and idf of pairs
 
     """
     @staticmethod
-    def search_score(search_pairs, pair_counts=None, total_exprs=None):
+    def search_score(search_pairs, pair_counts=None, total_exprs=None, distances=None):
         """
         Score for search pairs is the sum of the idf or the length of search pairs
 
         :type search_pairs: list
-        :param search_pairs: list of symbol pairs
+        :param search_pairs: list of symbol pair ids
 
         :rtype: double
         :return: score for this expression
@@ -64,7 +63,7 @@ class EverythingRanker(object):
         """
 
         if pair_counts != None and total_exprs != None:
-            return sum((1 / distance(p)) * idf(pair_counts[p], total_exprs) for p in search_pairs)
+            return sum((1 / distances[p]) * idf(pair_counts[p], total_exprs) for p in search_pairs)
         else:
             return len(search_pairs)
 
@@ -72,12 +71,12 @@ class EverythingRanker(object):
     fetch_paths = True
 
     @staticmethod
-    def rank(match_pairs, search_score, result_score, pair_counts, total_exprs, search_paths):
+    def rank(match_pairs, search_score, result_score, pair_counts, total_exprs, search_paths, distances=None):
         """
         Returns everythintf-idf-prefix based score
 
         :type match_pairs: list
-        :param match_pairs list of pairs that latched
+        :param match_pairs list of pair ids that latched
 
         :type search_score: double
         :param search_score: score for pairs in query
@@ -86,15 +85,18 @@ class EverythingRanker(object):
         :param result_score: score for pairs that matched
 
 
-        :type pair_counts: dict(str,int)
+        :type pair_counts: dict(int,int)
         :param pair_counts: frequency for each symbol pair
 
         :type total_exprs:
         :param total_exprs:
 
-        :type search_paths:dict(str,list)
+        :type search_paths:dict(int,list)
         :param: search_paths:given two symbol pairs, the path between them
 
+        :type distances: dict(int,int)
+        :param distances: horizontal distance of each symbol pair
+
         :rtype: double
         :return: score
 
@@ -102,7 +104,7 @@ class EverythingRanker(object):
 
         matches = defaultdict(float)
         for pair, path in match_pairs:
-            pair_score = (1 / distance(pair)) * idf(pair_counts[pair], total_exprs)
+            pair_score = (1 / distances[pair]) * idf(pair_counts[pair], total_exprs)
             for search_path in search_paths[pair]:
                 path_prefix = prefix(search_path, path)
                 matches[path_prefix] += pair_score
@@ -111,22 +113,21 @@ class EverythingRanker(object):
         return 2 * match_score / (search_score + result_score)
 
     @staticmethod
-    def second_pass(db):
+    def pair_weights(counts, distances, total_exprs):
         """
-        Update the everything  score of the expressions
+        Distance weighted idf of each pair, summed into the result score of each expression by the second pass
+
+        :type counts: numpy.ndarray
+        :param counts: frequency of each pair id
+
+        :type distances: numpy.ndarray
+        :param distances: horizontal distance of each pair id
+
+        :type total_exprs: int
+        :param total_exprs: number of expressions in the index
 
-        :type db: StrictRedis
-        :param db: Redis Database connection object
+        :rtype: numpy.ndarray
+        :return: weight of each pair
 
         """
-        pipe = db.pipeline()
-        all_pairs = list(db.smembers('all_pairs'))
-        for p in all_pairs:
-            pipe.llen('pair:%s:exprs' % p)
-        all_counts = dict((pair, int(count)) for (pair, count) in izip(all_pairs, pipe.execute()))
-
-        num_exprs = int(db.get('next_expr_id')) + 1
-        for i in range(num_exprs):
-            pairs = db.lrange('expr:%d:all_pairs' % i, 0, -1)
-            score = sum((1 / distance(p)) * idf(all_counts[p], num_exprs) for p in pairs)
-            db.set('expr:%d:everything_score' % i, score)
+        return np.log10(total_exprs / (counts + 1)) / distances
@@ -40,12 +40,12 @@ class FMeasureRanker(object):
     """
 
     @staticmethod
-    def search_score(search_pairs, pair_counts=None, total_exprs=None):
+    def search_score(search_pairs, pair_counts=None, total_exprs=None, distances=None):
         """
         Maximum score for search pairs is the number of symbol pairs
 
         :type search_pairs: list
-        :param search_pairs: list of symbol pairs
+        :param search_pairs: list of symbol pair ids
 
         :rtype: int
         :return: number of symbol pairs
@@ -57,12 +57,12 @@ class FMeasureRanker(object):
     fetch_paths = False
 
     @staticmethod
-    def rank(match_pairs, search_score, result_score, pair_counts, total_exprs, search_paths):
+    def rank(match_pairs, search_score, result_score, pair_counts, total_exprs, search_paths, distances=None):
         """
         Returns f-score
 
         :type match_pairs: list
-        :param match_pairs list of pairs that latched
+        :param match_pairs list of pair ids that latched
 
         :type search_score: double
         :param search_score: score for pairs in query
@@ -71,18 +71,42 @@ class FMeasureRanker(object):
         :param result_score: score for pairs that matched
 
 
-        :type pair_counts: dict(str,int)
+        :type pair_counts: dict(int,int)
         :param pair_counts: frequency for each symbol pair
 
         :type total_exprs:
         :param total_exprs:
 
-        :type search_paths:dict(str,list)
+        :type search_paths:dict(int,list)
         :param: search_paths:given two symbol pairs, the path between them
 
+        :type distances: dict(int,int)
+        :param distances: horizontal distance of each symbol pair
+
         :rtype: double
         :return: fscore
 
         """
         num_matches = len(match_pairs)
         return 2 * num_matches / (search_score + result_score)
+
+    @staticmethod
+    def match_weights(search_pairs, pair_counts, total_exprs, distances=None):
+        """
+        Every matched pair adds 1 to the match score m
+        """
+        return dict.fromkeys(search_pairs, 1)
+
+    @staticmethod
+    def rank_scores(match_scores, search_score, result_scores):
+        """
+        F-measure 2m / (s + r) of each candidate, s and r being the search and result scores
+        """
+        return 2 * match_scores / (search_score + result_scores)
+
+    @staticmethod
+    def max_rank(match_score, search_score):
+        """
+        Bound 2m / (s + m), as the result score r of a candidate is at least m
+        """
+        return 2 * match_score / (search_score + match_score)
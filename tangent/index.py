@@ -21,22 +21,68 @@
         - David Stalnaker: david.stalnaker@gmail.com
         - Richard Zanibbi: rlaz@cs.rit.edu
 """
-
 from __future__ import division
-from collections import namedtuple
+from collections import namedtuple, defaultdict, Counter
+from heapq import nlargest, heappush, heapreplace
+import copy
+import urllib
+import re
+
+import numpy as np
+
+from tangent import SymbolTree, StageTimer, FMeasureRanker, DistanceRanker, RecallRanker, PrefixRanker, TfIdfRanker, EverythingRanker, TfIdfPrefixRanker
+
+
+def all_rankers():
+    """
+    Return one instance of every ranker, the rankers whose result scores an index stores
+    """
+    return [FMeasureRanker(), DistanceRanker(), RecallRanker(), PrefixRanker(), TfIdfRanker(),
+            EverythingRanker(), TfIdfPrefixRanker()]
 
-from tangent import SymbolTree
 
 class Index:
     """
     A class to build an Index and search the index
+
+    Subclasses store the index and provide lookup_pairs, total_exprs, pair_frequencies,
+    fetch_postings, result_scores and fetch_results, the ranking is shared by all of them.
+    Searches call total_exprs before the other methods. Subclasses that can find a tree by its
+    fingerprint also provide exact_match.
+
+    Rankers provide search_score and rank. Rankers whose rank is a function of a match score, the
+    sum of per pair weights over the matched pairs, may also provide:
+
+    - match_weights(search_pairs, pair_counts, total_exprs, distances): dict of the weight of each
+      search pair id, so candidates are scored by accumulating posting lists (top_accumulated)
+    - rank_scores(match_scores, search_score, result_scores): NumPy array of the rank of every
+      candidate at once
+    - max_rank(match_score, search_score): upper bound of the rank of any expression with that
+      match score, which lets top_pruned skip candidates (see can_prune)
     """
-    def search_tex(self, tex):
+    ranker = None
+    result_cache = None
+    # Maximum horizontal distance and nesting depth of the indexed pairs, None for all pairs.
+    window = None
+    # Skip candidates that cannot enter the top results, for rankers that define max_rank.
+    prune = True
+    # Number of result scores fetched at a time while pruning.
+    prune_batch = 100
+    # Maximum number of document links returned per result, None for all of them.
+    max_links = None
+    # Also return the mathml of each result, when the index stores it.
+    fetch_mathml = False
+    # Metrics registry receiving the stage timings and counters of every search, None to disable.
+    metrics = None
+    # Put the expression identical to the query, if it is indexed, first in the results.
+    exact_first = True
+
+    def search_tex(self, tex, k=10, offset=0):
         """
         Search the index for a given tex expression
 
         """
-        return self.search(SymbolTree.parse_from_tex(tex))
+        return self.search(SymbolTree.parse_from_tex(tex), k, offset)
 
     def add_all(self, trees):
         for t in trees:
@@ -54,4 +100,478 @@ class Index:
     def second_pass(self):
         pass
 
-Result = namedtuple('Result', ['latex', 'score', 'debug_info', 'links', 'expr_id'])
+    def refresh(self):
+        """
+        Pick up changes made to the index by other processes
+        """
+        pass
+
+    def generation(self):
+        """
+        Return the generation number of the index, which changes every time the index is modified
+
+        :rtype: int
+        :return: generation number
+        """
+        return 0
+
+    def with_ranker(self, ranker):
+        """
+        Return a view of the index that ranks with another ranker
+
+        The view shares the storage, connections and caches of this index, so several rankers can
+        be served from one index.
+
+        :type ranker: object
+        :param ranker: ranker used by the view
+
+        :rtype: Index
+        :return: view of this index
+        """
+        view = copy.copy(self)
+        view.ranker = ranker
+        return view
+
+    def exact_match(self, search_tree):
+        """
+        Return the id of the expression identical to the search tree
+
+        :type search_tree: SymbolTree
+        :param search_tree: Symbol Tree
+
+        :rtype: int
+        :return: expression id, None if the tree is not indexed or the index cannot tell
+        """
+        return None
+
+    def scores_current(self):
+        """
+        Return True if the result scores computed by the second pass are up to date
+        """
+        return True
+
+    def min_pair_weight(self):
+        """
+        Return the smallest pair weight summed into the result scores of the ranker
+
+        :rtype: double
+        :return: smallest weight, None if the index did not record it
+        """
+        return None
+
+    def search(self, search_tree, k=10, offset=0):
+        """
+        Return all matches for this search tree, reusing the results of an identical earlier search
+        if the index has not changed since
+
+        :type search_tree: SymbolTree
+        :param search_tree:Symbol Tree
+
+        :type k: int
+        :param k: number of results to return
+
+        :type offset: int
+        :param offset: number of top results to skip, for pagination
+
+
+        :rtype: (list[Result], int, dict(str,int))
+        :return: top search results, number of matches and frequency of each search pair
+
+        """
+        if self.result_cache is None:
+            return self.search_uncached(search_tree, k, offset)
+
+        key = (self.ranker.__class__.__name__, search_tree.build_repr(), self.generation(), k, offset)
+        cached = self.result_cache.get(key)
+        if cached is None:
+            cached = self.search_uncached(search_tree, k, offset)
+            self.result_cache.put(key, cached)
+        return cached
+
+    def search_uncached(self, search_tree, k=10, offset=0):
+        """
+        Return all matches for this search tree
+
+        :type search_tree: SymbolTree
+        :param search_tree:Symbol Tree
+
+        :type k: int
+        :param k: number of results to return
+
+        :type offset: int
+        :param offset: number of top results to skip, for pagination
+
+
+        :rtype: (list[Result], int, dict(str,int))
+        :return: top search results, number of matches and frequency of each search pair
+
+        """
+        timer = StageTimer()
+        top, num_matches, names, pair_counts = self.top_results(search_tree, offset + k, timer)
+        results = self.hydrate(top[offset:], names)
+        timer.lap('hydrate')
+        if self.metrics is not None:
+            self.record_search(timer)
+        return results, num_matches, dict((names[pair], c) for pair, c in pair_counts.items())
+
+    def top_results(self, search_tree, n, timer, statistics=None):
+        """
+        Return the n best matches for this search tree, without their text and documents
+
+        :type search_tree: SymbolTree
+        :param search_tree: Symbol Tree
+
+        :type n: int
+        :param n: number of matches to return
+
+        :type timer: StageTimer
+        :param timer: timer of the search
+
+        :type statistics: (int, dict(str,int))
+        :param statistics: number of expressions and frequency of each search pair in a whole
+            collection, for indexes holding a part of it; taken from this index by default
+
+        :rtype: (list((int,double,list)), int, dict(int,str), dict(int,int))
+        :return: best matches as returned by top_matches, number of matches, pair of each search
+            pair id and frequency of each search pair id
+        """
+        self.refresh()
+        total_exprs = statistics[0] if statistics else self.total_exprs()
+
+        # Queries use the same pair window as the indexed expressions.
+        search_pairs, paths = search_tree.get_pairs(get_paths=True, window=self.window)
+        search_ids, distances = self.lookup_pairs(search_pairs)
+        names = dict(zip(search_ids, search_pairs))
+        search_paths = defaultdict(list)
+        for pair, path in zip(search_ids, paths):
+            search_paths[pair].append(path)
+        search_pair_counts = Counter(search_ids).items()
+        exact_id = self.exact_match(search_tree) if self.exact_first else None
+        timer.lap('pairs')
+
+        # Pairs missing from the dictionary (negative ids) do not occur in any expression.
+        indexed = [pair for pair, count in search_pair_counts if pair >= 0]
+
+        # Get expressions that contain each pair, and the frequency of each pair.
+        if statistics:
+            pair_counts = dict((pair, statistics[1].get(names[pair], 0))
+                               for pair, count in search_pair_counts)
+        else:
+            pair_counts = dict((pair, 0) for pair, count in search_pair_counts)
+            pair_counts.update(zip(indexed, self.pair_frequencies(indexed)))
+        postings = dict(zip(indexed, self.fetch_postings(indexed, self.ranker.fetch_paths)))
+        for pair in indexed:
+            if pair_counts[pair] is None:
+                # The index does not know this frequency, count the postings instead.
+                pair_counts[pair] = len(postings[pair][0])
+        timer.count('postings', sum(len(postings[pair][0]) for pair in indexed))
+        timer.lap('postings')
+
+        # Get max score for the search term
+        search_score = self.ranker.search_score(search_ids, pair_counts,
+                                                total_exprs, distances)
+
+        top, num_matches = self.top_matches(search_pair_counts, postings, n,
+                                            search_score, pair_counts, total_exprs,
+                                            search_paths, distances, timer)
+        timer.count('candidates', num_matches)
+
+        # An indexed copy of the query goes first, ranked on its own if it missed the top.
+        if exact_id is not None:
+            timer.count('exact', 1)
+            exact = [m for m in top if m[0] == exact_id]
+            if not exact:
+                exact_postings = dict((pair, self.select_postings(posting, exact_id))
+                                      for pair, posting in postings.iteritems())
+                exact, _ = self.top_matches(search_pair_counts, exact_postings, 1, search_score,
+                                            pair_counts, total_exprs, search_paths, distances,
+                                            timer)
+            top = (exact + [m for m in top if m[0] != exact_id])[:n]
+        return top, num_matches, names, pair_counts
+
+    def hydrate(self, top, names):
+        """
+        Get the text and documents of the best matches at once, and build their results
+
+        :type top: list((int,double,list))
+        :param top: best matches as returned by top_results
+
+        :type names: dict(int,str)
+        :param names: pair of each search pair id
+
+        :rtype: list(Result)
+        :return: search results
+        """
+        results = []
+        hydrated = self.fetch_results([expr_id for expr_id, _, _ in top])
+        for (expr_id, count, match_pairs), (latex, documents, mathml) in zip(top, hydrated):
+            if self.ranker.fetch_paths:
+                match_pairs = [(names[pair], path) for pair, path in match_pairs]
+            else:
+                match_pairs = [names[pair] for pair in match_pairs]
+            results.append(Result(latex=latex,
+                                  score=count,
+                                  debug_info=['Pairs: %s' % match_pairs],
+                                  links=[self.create_document_link(d) for d in documents],
+                                  expr_id=expr_id,
+                                  mathml=mathml))
+        return results
+
+    def record_search(self, timer):
+        """
+        Add the stage timings and counters of a search to the metrics, labelled with the ranker
+
+        :type timer: StageTimer
+        :param timer: timer of the search
+        """
+        ranker = (('ranker', self.ranker.__class__.__name__),)
+        self.metrics.inc('tangent_searches_total', ranker)
+        self.metrics.observe('tangent_search_seconds', ranker, timer.total())
+        for stage, seconds in timer.stages.iteritems():
+            self.metrics.observe('tangent_search_stage_seconds', ranker + (('stage', stage),),
+                                 seconds)
+        for name, value in timer.counts.iteritems():
+            self.metrics.inc('tangent_search_%s_total' % name, ranker, value)
+
+    def top_matches(self, search_pair_counts, postings, n, search_score, pair_counts,
+                    total_exprs, search_paths, distances, timer):
+        """
+        Return the n best matches with top_accumulated if the ranker supports it, or with
+        top_ranked otherwise
+
+        :rtype: (list((int,double,list)), int)
+        :return: expression id, score and matched pairs of the best matches, best first, and the
+            number of matches
+        """
+        if hasattr(self.ranker, 'match_weights'):
+            return self.top_accumulated(search_pair_counts, postings, n, search_score,
+                                        pair_counts, total_exprs, distances, timer)
+        return self.top_ranked(search_pair_counts, postings, n, search_score, pair_counts,
+                               total_exprs, search_paths, distances, timer)
+
+    @staticmethod
+    def select_postings(posting, expr_id):
+        """
+        Return the part of a posting list that belongs to one expression
+
+        :type posting: (numpy.ndarray, list)
+        :param posting: expression ids and paths (or None) of a pair
+
+        :type expr_id: int
+        :param expr_id: expression id
+
+        :rtype: (numpy.ndarray, list)
+        :return: expression ids and paths (or None) of the postings of the expression
+        """
+        expressions, paths = posting
+        selected = np.flatnonzero(expressions == expr_id)
+        return expressions[selected], [paths[i] for i in selected] if paths is not None else None
+
+    def top_ranked(self, search_pair_counts, postings, n, search_score, pair_counts,
+                   total_exprs, search_paths, distances, timer):
+        """
+        Return the n best matches, collecting the matched pairs of every candidate and ranking
+        them one by one with the rank method of the ranker
+
+        This works with any ranker, including the ones that compare the paths of the pairs.
+
+        :rtype: (list((int,double,list)), int)
+        :return: expression id, score and matched pairs of the best matches, best first, and the
+            number of matches
+        """
+        matches = defaultdict(list)
+        for pair, count in search_pair_counts:
+            if pair not in postings:
+                continue
+            expressions, paths = postings[pair]
+            if self.ranker.fetch_paths:
+                for e, path in zip(expressions.tolist(), paths):
+                    matches[e].append((pair, path))
+            else:
+                prev = None
+                for e in expressions.tolist():
+                    match_count = match_count + 1 if e == prev else 1
+                    if match_count <= count:
+                        matches[e].append(pair)
+                    prev = e
+        timer.lap('accumulate')
+
+        # Get number of pairs in each matched expression.
+        result_scores = self.result_scores(matches.keys())
+        timer.count('scored', len(matches))
+        timer.lap('result_scores')
+
+        # Calculate a score for each matched expression.
+        ranked_matches = [(expr_id,
+                           self.ranker.rank(match_pairs, search_score,
+                                            result_score, pair_counts,
+                                            total_exprs, search_paths, distances),
+                           match_pairs)
+                          for (expr_id, match_pairs), result_score
+                          in zip(matches.items(), result_scores)]
+        timer.lap('rank')
+
+        # Select the top results with a bounded heap, breaking ties by expression id.
+        top = nlargest(n, ranked_matches, key=lambda m: (m[1], -m[0]))
+        timer.lap('sort')
+        return top, len(matches)
+
+    def top_accumulated(self, search_pair_counts, postings, n, search_score, pair_counts,
+                        total_exprs, distances, timer):
+        """
+        Return the n best matches, computing the match score of every candidate with array
+        operations over the posting lists
+
+        The rankers taking this path define match_weights and rank_scores. Each posting list is
+        reduced to its distinct expressions and the number of occurrences that match, at most as
+        many as in the query, and the weighted counts are scattered into one accumulator per
+        candidate.
+
+        :rtype: (list((int,double,list)), int)
+        :return: expression id, score and matched pairs of the best matches, best first, and the
+            number of matches
+        """
+        weights = self.ranker.match_weights([pair for pair, count in search_pair_counts],
+                                            pair_counts, total_exprs, distances)
+        lists = [(pair, count, postings[pair][0]) for pair, count in search_pair_counts
+                 if pair in postings and len(postings[pair][0])]
+        if not lists:
+            return [], 0
+
+        # Concatenate the posting lists, and reduce them to runs of one expression within one
+        # list. Each run matches as many times as it is long, but at most as often as the pair
+        # occurs in the query.
+        postings = np.concatenate([expressions for _, _, expressions in lists])
+        owners = np.repeat(np.arange(len(lists)), [len(expressions) for _, _, expressions in lists])
+        starts = np.flatnonzero(np.concatenate(([True], (postings[1:] != postings[:-1]) |
+                                                        (owners[1:] != owners[:-1]))))
+        exprs = postings[starts]
+        owners = owners[starts]
+        query_counts = np.array([count for _, count, _ in lists])
+        matched = np.minimum(np.diff(np.append(starts, len(postings))), query_counts[owners])
+
+        list_weights = np.array([weights[pair] for pair, _, _ in lists], dtype=np.float64)
+        candidates, positions = np.unique(exprs, return_inverse=True)
+        match_scores = np.bincount(positions, weights=matched * list_weights[owners],
+                                   minlength=len(candidates))
+        timer.lap('accumulate')
+
+        if self.can_prune(weights):
+            selected = self.top_pruned(candidates, match_scores, n, search_score, timer)
+        else:
+            result_scores = np.asarray(self.result_scores(candidates), dtype=np.float64)
+            timer.count('scored', len(candidates))
+            timer.lap('result_scores')
+            scores = self.ranker.rank_scores(match_scores, search_score, result_scores)
+            timer.lap('rank')
+            # Best score first, ties broken by expression id.
+            best = np.lexsort((candidates, -scores))[:n]
+            selected = zip(candidates[best].tolist(), scores[best].tolist())
+            timer.lap('sort')
+
+        # Recover the matched pairs of the selected expressions from the runs.
+        match_pairs = defaultdict(list)
+        selected_ids = np.array([expr_id for expr_id, _ in selected], dtype=exprs.dtype)
+        for i in np.flatnonzero(np.in1d(exprs, selected_ids)).tolist():
+            match_pairs[int(exprs[i])].extend([lists[owners[i]][0]] * int(matched[i]))
+        top = [(expr_id, score, match_pairs[expr_id]) for expr_id, score in selected]
+        return top, len(candidates)
+
+    def can_prune(self, weights):
+        """
+        Return True if candidates may be skipped using the max_rank bound of the ranker
+
+        The bound relies on the result score of an expression being at least its match score,
+        which holds when the result scores are current and none of the pair weights summed into
+        them is negative, not only the weights of the search pairs.
+
+        :type weights: dict(int,double)
+        :param weights: match weight of each search pair id
+
+        :rtype: bool
+        """
+        if not self.prune or not hasattr(self.ranker, 'max_rank'):
+            return False
+        if hasattr(self.ranker, 'pair_weights'):
+            if not self.scores_current():
+                return False
+            min_weight = self.min_pair_weight()
+            if min_weight is None or min_weight < 0:
+                return False
+        return min(weights.itervalues()) >= 0
+
+    def top_pruned(self, candidates, match_scores, n, search_score, timer):
+        """
+        Return the n best candidates, ranking only the ones that can still enter them
+
+        Candidates are visited in decreasing order of the upper bound of their rank, and their
+        result scores fetched a batch at a time. The search stops as soon as the bound of the
+        next candidate is below the score of the n-th best match found so far.
+
+        :type candidates: numpy.ndarray
+        :param candidates: sorted ids of the matched expressions
+
+        :type match_scores: numpy.ndarray
+        :param match_scores: match score of each candidate
+
+        :type n: int
+        :param n: number of matches to return
+
+        :type search_score: double
+        :param search_score: score for pairs in query
+
+        :type timer: StageTimer
+        :param timer: timer of the search
+
+        :rtype: list((int,double))
+        :return: expression id and score of the best matches, best first
+        """
+        if n <= 0:
+            return []
+        bounds = self.ranker.max_rank(match_scores, search_score)
+        order = np.argsort(-bounds, kind='mergesort')
+        timer.lap('sort')
+
+        # Min heap of (score, -expr_id), the worst of the best n matches is on top.
+        top = []
+        for start in xrange(0, len(order), max(n, self.prune_batch)):
+            # Leave some slack for rounding, as the bound and the rank sum floats differently.
+            if len(top) == n and bounds[order[start]] * (1 + 1e-9) < top[0][0]:
+                break
+            batch = order[start:start + max(n, self.prune_batch)]
+            result_scores = np.asarray(self.result_scores(candidates[batch]), dtype=np.float64)
+            timer.count('scored', len(batch))
+            timer.lap('result_scores')
+            scores = self.ranker.rank_scores(match_scores[batch], search_score, result_scores)
+            for expr_id, score in zip(candidates[batch].tolist(), scores.tolist()):
+                if len(top) < n:
+                    heappush(top, (score, -expr_id))
+                elif (score, -expr_id) > top[0]:
+                    heapreplace(top, (score, -expr_id))
+            timer.lap('rank')
+
+        top = [(-neg_id, score) for score, neg_id in sorted(top, reverse=True)]
+        timer.lap('sort')
+        return top
+
+    def create_document_link(self, path):
+        """
+        Given the path of the document, return the direct wikipedia link and the name of the article
+
+        :type path:str
+        :param path:wikipedia link
+
+        :rtype: (str,str)
+        :return: wikipedia link and title of article
+        """
+        match = document_name.search(path)
+        if match:
+            name = match.group(1)
+            return wikipedia_link % urllib.quote(name), 'Wikipedia - ' + name
+        else:
+            return path, path
+
+document_name = re.compile(r'([^/]*)\.mml')
+wikipedia_link = 'http://en.wikipedia.org/w/index.php?search=%s&go=Go'
+
+Result = namedtuple('Result', ['latex', 'score', 'debug_info', 'links', 'expr_id', 'mathml'])
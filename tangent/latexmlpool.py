@@ -0,0 +1,240 @@
+"""
+    Tangent
+    Copyright (c) 2013 David Stalnaker, Richard Zanibbi
+
+    This file is part of Tangent.
+
+    Tanget is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Tangent is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Tangent.  If not, see <http://www.gnu.org/licenses/>.
+
+    Contact:
+        - David Stalnaker: david.stalnaker@gmail.com
+        - Richard Zanibbi: rlaz@cs.rit.edu
+"""
+
+"""
+Pool of long-lived LaTeXML converters used to turn tex into presentation mathml
+
+Each worker owns a latexmls daemon (shipped with LaTeXML), so the Perl startup cost is paid once
+per worker instead of once per expression. When latexmls is not available the worker falls back
+to running latexmlmath for every request.
+
+Daemons are stopped when the process that started them exits, including multiprocessing workers,
+which skip atexit handlers. A daemon also exits by itself once idle for daemon_expire seconds, so
+the daemons of a killed process do not outlive it for long.
+"""
+
+import httplib
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+import urllib
+from multiprocessing.util import Finalize, register_after_fork
+from Queue import Queue
+
+
+class LatexmlError(Exception):
+    """
+    An exception to indicate that a tex expression could not be converted
+    """
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+
+def free_port():
+    """
+    Return a local tcp port that is currently unused
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class LatexmlWorker(object):
+    """
+    A single converter backed by a latexmls daemon listening on a local port
+
+    The daemon is started lazily and restarted whenever it crashes, times out or expired.
+    """
+    daemon_expire = 600
+    daemon_command = ['latexmls', '--expire=%d' % daemon_expire]
+    oneshot_command = ['latexmlmath', '--pmml=-', '-']
+    options = [('profile', 'math'), ('pmml', '')]
+
+    def __init__(self, timeout=10, startup_timeout=30):
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self.port = None
+        self.persistent = True
+
+    def start(self):
+        """
+        Start the latexmls daemon and wait until it accepts connections
+        """
+        self.stop()
+        self.port = free_port()
+        devnull = open(os.devnull, 'w')
+        try:
+            self.process = subprocess.Popen(self.daemon_command + ['--port=%d' % self.port],
+                                            stdout=devnull, stderr=devnull)
+        except OSError:
+            # latexmls is not installed, use one latexmlmath process per request instead.
+            self.persistent = False
+            return
+
+        deadline = time.time() + self.startup_timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                # The daemon exited on startup, it will not get any better on retry.
+                self.process = None
+                self.persistent = False
+                return
+            try:
+                socket.create_connection(('127.0.0.1', self.port), 1).close()
+                return
+            except socket.error:
+                time.sleep(0.1)
+        self.stop()
+        raise LatexmlError('latexmls did not start within %d seconds' % self.startup_timeout)
+
+    def stop(self):
+        """
+        Kill the daemon if it is running
+        """
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def convert(self, tex, retry=True):
+        """
+        Convert tex to presentation mathml
+
+        :type tex: string
+        :param tex: tex expression
+
+        :type retry: bool
+        :param retry: restart the daemon and retry once if it crashes
+
+        :rtype: string
+        :return: mathml document produced by LaTeXML
+        """
+        if isinstance(tex, unicode):
+            tex = tex.encode('utf-8')
+        if self.persistent and not self.alive():
+            self.start()
+        if not self.persistent:
+            return self.convert_oneshot(tex)
+
+        body = urllib.urlencode(self.options + [('tex', tex)])
+        try:
+            conn = httplib.HTTPConnection('127.0.0.1', self.port, timeout=self.timeout)
+            conn.request('POST', '/', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+            response = json.loads(conn.getresponse().read())
+            conn.close()
+        except socket.timeout:
+            # The daemon is stuck on this expression, so throw it away.
+            self.stop()
+            raise LatexmlError('conversion timed out after %d seconds' % self.timeout)
+        except (socket.error, httplib.HTTPException, ValueError):
+            # The daemon crashed mid request, restart it and try once more.
+            self.stop()
+            if retry:
+                return self.convert(tex, retry=False)
+            raise LatexmlError('latexmls crashed while converting')
+
+        result = response.get('result')
+        if not result:
+            raise LatexmlError(response.get('log') or 'latexmls returned no result')
+        return result.encode('utf-8') if isinstance(result, unicode) else result
+
+    def convert_oneshot(self, tex):
+        """
+        Convert tex to presentation mathml with a fresh latexmlmath process
+        """
+        p = subprocess.Popen(self.oneshot_command, stdout=subprocess.PIPE, stdin=subprocess.PIPE,
+                             stderr=open(os.devnull, 'w'))
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            p.kill()
+        timer = threading.Timer(self.timeout, expire)
+        timer.start()
+        try:
+            (output, _) = p.communicate(input=tex)
+        finally:
+            timer.cancel()
+        if expired.is_set():
+            raise LatexmlError('conversion timed out after %d seconds' % self.timeout)
+        if p.returncode < 0:
+            raise LatexmlError('latexmlmath was killed by signal %d' % -p.returncode)
+        return output
+
+
+class LatexmlPool(object):
+    """
+    Fixed size pool of LatexmlWorkers shared by all threads of a process
+    """
+    def __init__(self, size=2, timeout=10):
+        self.size = size
+        self.timeout = timeout
+        self.create_workers()
+        # Unlike atexit handlers, finalizers also run when multiprocessing workers exit.
+        Finalize(self, self.close, exitpriority=10)
+        register_after_fork(self, LatexmlPool.after_fork)
+
+    def create_workers(self):
+        self.workers = [LatexmlWorker(timeout=self.timeout) for _ in range(self.size)]
+        self.idle = Queue()
+        for worker in self.workers:
+            self.idle.put(worker)
+
+    def after_fork(self):
+        """
+        Give a multiprocessing worker its own daemons, the inherited ones belong to the parent
+        """
+        self.create_workers()
+        Finalize(self, self.close, exitpriority=10)
+
+    def convert(self, tex):
+        """
+        Convert tex to presentation mathml on the first idle worker
+
+        :type tex: string
+        :param tex: tex expression
+
+        :rtype: string
+        :return: mathml document produced by LaTeXML
+        """
+        worker = self.idle.get()
+        try:
+            return worker.convert(tex)
+        finally:
+            self.idle.put(worker)
+
+    def close(self):
+        """
+        Stop all the daemons in the pool
+        """
+        for worker in self.workers:
+            worker.stop()
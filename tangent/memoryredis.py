@@ -0,0 +1,263 @@
+"""
+    Tangent
+    Copyright (c) 2013 David Stalnaker, Richard Zanibbi
+
+    This file is part of Tangent.
+
+    Tanget is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Tangent is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Tangent.  If not, see <http://www.gnu.org/licenses/>.
+
+    Contact:
+        - David Stalnaker: david.stalnaker@gmail.com
+        - Richard Zanibbi: rlaz@cs.rit.edu
+"""
+
+"""
+In process stand-in for the subset of the redis client used by the index
+
+MemoryRedis keeps every key in python dictionaries and follows the return values of
+redis.StrictRedis for the commands it supports, so benchmarks and experiments can run a RedisIndex
+without a redis server. Values are stored as byte strings like redis does. Nothing is persisted.
+"""
+
+import threading
+import time
+
+
+def to_bytes(value):
+    """
+    Convert a key or value to the byte string redis would store
+    """
+    if type(value) is str:
+        return value
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class MemoryRedis(object):
+    """
+    Thread safe in memory implementation of the redis commands used by Tangent
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.data = {}
+        self.expires = {}
+
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+    def lookup(self, key, default=None):
+        """
+        Return the value of a key, dropping it first if it expired
+        """
+        key = to_bytes(key)
+        expires = self.expires.get(key) if self.expires else None
+        if expires is not None and expires <= time.time():
+            del self.data[key]
+            del self.expires[key]
+        return self.data.get(key, default)
+
+    def container(self, name, factory):
+        """
+        Return the hash, list or set stored at a key, storing an empty one first if needed
+        """
+        value = self.lookup(name)
+        if value is None:
+            value = self.data[to_bytes(name)] = factory()
+        return value
+
+    def flushdb(self):
+        with self.lock:
+            self.data.clear()
+            self.expires.clear()
+        return True
+
+    def delete(self, *names):
+        with self.lock:
+            deleted = 0
+            for name in names:
+                if self.lookup(name) is not None:
+                    del self.data[to_bytes(name)]
+                    self.expires.pop(to_bytes(name), None)
+                    deleted += 1
+            return deleted
+
+    def exists(self, name):
+        with self.lock:
+            return self.lookup(name) is not None
+
+    def rename(self, src, dst):
+        with self.lock:
+            if self.lookup(src) is None:
+                raise KeyError('no such key %s' % src)
+            self.delete(dst)
+            self.data[to_bytes(dst)] = self.data.pop(to_bytes(src))
+            if to_bytes(src) in self.expires:
+                self.expires[to_bytes(dst)] = self.expires.pop(to_bytes(src))
+            return True
+
+    # Strings
+
+    def get(self, name):
+        with self.lock:
+            return self.lookup(name)
+
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False):
+        with self.lock:
+            exists = self.lookup(name) is not None
+            if (nx and exists) or (xx and not exists):
+                return None
+            key = to_bytes(name)
+            self.data[key] = to_bytes(value)
+            self.expires.pop(key, None)
+            if ex is not None:
+                self.expires[key] = time.time() + ex
+            elif px is not None:
+                self.expires[key] = time.time() + px / 1000.0
+            return True
+
+    def setnx(self, name, value):
+        return self.set(name, value, nx=True) is not None
+
+    def incrby(self, name, amount=1):
+        with self.lock:
+            value = int(self.lookup(name, 0)) + amount
+            self.data[to_bytes(name)] = str(value)
+            return value
+
+    incr = incrby
+
+    def append(self, key, value):
+        with self.lock:
+            value = self.lookup(key, '') + to_bytes(value)
+            self.data[to_bytes(key)] = value
+            return len(value)
+
+    # Hashes
+
+    def hget(self, name, key):
+        with self.lock:
+            return self.lookup(name, {}).get(to_bytes(key))
+
+    def hset(self, name, key, value):
+        with self.lock:
+            h = self.container(name, dict)
+            created = to_bytes(key) not in h
+            h[to_bytes(key)] = to_bytes(value)
+            return int(created)
+
+    def hincrby(self, name, key, amount=1):
+        with self.lock:
+            h = self.container(name, dict)
+            value = int(h.get(to_bytes(key), 0)) + amount
+            h[to_bytes(key)] = str(value)
+            return value
+
+    def hsetnx(self, name, key, value):
+        with self.lock:
+            h = self.container(name, dict)
+            if to_bytes(key) in h:
+                return False
+            h[to_bytes(key)] = to_bytes(value)
+            return True
+
+    def hmget(self, name, keys, *args):
+        with self.lock:
+            h = self.lookup(name, {})
+            keys = list(keys) if isinstance(keys, (list, tuple)) else [keys]
+            return [h.get(to_bytes(key)) for key in keys + list(args)]
+
+    def hmset(self, name, mapping):
+        with self.lock:
+            h = self.container(name, dict)
+            for key, value in mapping.iteritems():
+                h[to_bytes(key)] = to_bytes(value)
+            return True
+
+    def hlen(self, name):
+        with self.lock:
+            return len(self.lookup(name, {}))
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self.lookup(name, {}))
+
+    def hscan_iter(self, name, match=None, count=None):
+        # The whole hash is copied at once, match patterns are not supported.
+        return self.hgetall(name).iteritems()
+
+    # Lists
+
+    def rpush(self, name, *values):
+        with self.lock:
+            l = self.container(name, list)
+            l.extend(to_bytes(value) for value in values)
+            return len(l)
+
+    def lrange(self, name, start, end):
+        with self.lock:
+            l = self.lookup(name, [])
+            # Redis includes the end index, -1 meaning the last element.
+            end = len(l) if end == -1 else end + 1
+            return l[start:end]
+
+    # Sets
+
+    def sadd(self, name, *values):
+        with self.lock:
+            s = self.container(name, set)
+            added = 0
+            for value in values:
+                if to_bytes(value) not in s:
+                    s.add(to_bytes(value))
+                    added += 1
+            return added
+
+    def smembers(self, name):
+        with self.lock:
+            return set(self.lookup(name, set()))
+
+    def sort(self, name, start=None, num=None, alpha=False, desc=False):
+        with self.lock:
+            values = sorted(self.lookup(name, []), key=None if alpha else float, reverse=desc)
+            if start is not None and num is not None:
+                values = values[start:start + num]
+            return values
+
+
+class MemoryPipeline(object):
+    """
+    Queue of commands run on a MemoryRedis by execute, under its lock so they apply atomically
+    """
+    def __init__(self, db):
+        self.db = db
+        self.commands = []
+
+    def __getattr__(self, command):
+        method = getattr(self.db, command)
+
+        def queue(*args, **kwargs):
+            self.commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self.db.lock:
+            commands, self.commands = self.commands, []
+            return [method(*args, **kwargs) for method, args, kwargs in commands]
+
+    def reset(self):
+        self.commands = []
@@ -0,0 +1,172 @@
+"""
+    Tangent
+    Copyright (c) 2013 David Stalnaker, Richard Zanibbi
+
+    This file is part of Tangent.
+
+    Tanget is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Tangent is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Tangent.  If not, see <http://www.gnu.org/licenses/>.
+
+    Contact:
+        - David Stalnaker: david.stalnaker@gmail.com
+        - Richard Zanibbi: rlaz@cs.rit.edu
+"""
+
+"""
+Counters, gauges and histograms exported in the Prometheus text format
+
+Search stages are timed with a StageTimer, whose laps the index records into its Metrics.
+"""
+
+from bisect import bisect_left
+import threading
+import time
+
+# Upper bounds in seconds of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HELP = {
+    'tangent_searches_total': 'Searches run on the index, not counting result cache hits',
+    'tangent_search_seconds': 'Latency of searches run on the index',
+    'tangent_search_stage_seconds': 'Time spent in each stage of the searches: pairs, postings, '
+                                    'accumulate, result_scores, rank, sort and hydrate, or '
+                                    'statistics, shards and hydrate for sharded indexes',
+    'tangent_search_postings_total': 'Postings fetched for the pairs of the queries',
+    'tangent_search_candidates_total': 'Expressions matching at least one pair of the queries',
+    'tangent_search_scored_total': 'Candidates whose result score was fetched and ranked',
+    'tangent_search_exact_total': 'Searches whose query is an indexed expression',
+}
+
+
+class StageTimer(object):
+    """
+    Stopwatch splitting the time of one search between its stages
+
+    Each lap charges the time since the previous lap to a stage, so stages that alternate, such as
+    fetching and ranking batches of candidates, add up correctly.
+    """
+    def __init__(self):
+        self.start = self.last = time.time()
+        self.stages = {}
+        self.counts = {}
+
+    def lap(self, stage):
+        """
+        Charge the time elapsed since the last lap to a stage
+        """
+        now = time.time()
+        self.stages[stage] = self.stages.get(stage, 0) + now - self.last
+        self.last = now
+
+    def count(self, name, value):
+        """
+        Add to a counter of the search, such as the number of candidates
+        """
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def total(self):
+        """
+        Return the seconds elapsed since the timer started
+        """
+        return self.last - self.start
+
+
+def format_value(value):
+    return '%d' % value if isinstance(value, (int, long)) else repr(float(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in labels)
+
+
+class Metrics(object):
+    """
+    Thread safe registry of metrics
+
+    Metrics are created on first use, and identified by their name and a tuple of (label, value)
+    pairs.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.types = {}
+        self.help = dict(HELP)
+        self.values = {}
+        self.histograms = {}
+
+    def describe(self, name, text):
+        """
+        Set the help text of a metric
+        """
+        self.help[name] = text
+
+    def inc(self, name, labels=(), value=1):
+        """
+        Increase a counter
+        """
+        with self.lock:
+            self.types.setdefault(name, 'counter')
+            self.values[name, labels] = self.values.get((name, labels), 0) + value
+
+    def set(self, name, labels=(), value=0):
+        """
+        Set a gauge
+        """
+        with self.lock:
+            self.types.setdefault(name, 'gauge')
+            self.values[name, labels] = value
+
+    def observe(self, name, labels=(), value=0):
+        """
+        Add a value to a histogram
+        """
+        with self.lock:
+            self.types.setdefault(name, 'histogram')
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                # Counts per bucket, the last one for values above every bound, and the sum.
+                histogram = self.histograms[name, labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            histogram[0][bisect_left(self.buckets, value)] += 1
+            histogram[1] += value
+
+    def render(self):
+        """
+        Return all the metrics in the Prometheus text exposition format
+
+        :rtype: str
+        """
+        lines = []
+        with self.lock:
+            for name in sorted(self.types):
+                if name in self.help:
+                    lines.append('# HELP %s %s' % (name, self.help[name]))
+                lines.append('# TYPE %s %s' % (name, self.types[name]))
+                if self.types[name] != 'histogram':
+                    for (n, labels), value in sorted(self.values.items()):
+                        if n == name:
+                            lines.append('%s%s %s' % (name, format_labels(labels), format_value(value)))
+                    continue
+                for (n, labels), (counts, total) in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + ('+Inf',), counts):
+                        cumulative += count
+                        lines.append('%s_bucket%s %d' % (name, format_labels(labels + (('le', bound),)),
+                                                         cumulative))
+                    lines.append('%s_sum%s %s' % (name, format_labels(labels), format_value(total)))
+                    lines.append('%s_count%s %d' % (name, format_labels(labels), cumulative))
+        return '\n'.join(lines) + '\n'
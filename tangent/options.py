@@ -0,0 +1,61 @@
+"""
+    Tangent
+    Copyright (c) 2013 David Stalnaker, Richard Zanibbi
+
+    This file is part of Tangent.
+
+    Tanget is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Tangent is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Tangent.  If not, see <http://www.gnu.org/licenses/>.
+
+    Contact:
+        - David Stalnaker: david.stalnaker@gmail.com
+        - Richard Zanibbi: rlaz@cs.rit.edu
+"""
+
+"""
+Command line helpers shared by the scripts
+"""
+
+
+def parse_options(args):
+    """
+    Split --name=value options from the positional arguments
+
+    :rtype: (dict(str,str), list(str))
+    :return: options and positional arguments
+    """
+    options = {}
+    positional = []
+    for arg in args:
+        if arg.startswith('--') and '=' in arg:
+            name, value = arg[2:].split('=', 1)
+            options[name.replace('-', '_')] = value
+        else:
+            positional.append(arg)
+    return options, positional
+
+
+def int_option(value, minimum=None):
+    """
+    Parse an integer option
+
+    :rtype: int
+    :return: value of the option, None if it is not an integer or is below minimum
+    """
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    if minimum is not None and value < minimum:
+        return None
+    return value
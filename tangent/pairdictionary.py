@@ -0,0 +1,200 @@
+"""
+    Tangent
+    Copyright (c) 2013 David Stalnaker, Richard Zanibbi
+
+    This file is part of Tangent.
+
+    Tanget is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Tangent is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Tangent.  If not, see <http://www.gnu.org/licenses/>.
+
+    Contact:
+        - David Stalnaker: david.stalnaker@gmail.com
+        - Richard Zanibbi: rlaz@cs.rit.edu
+"""
+
+"""
+Dictionary assigning compact integer ids to symbol pairs
+
+The index stores pair ids instead of pair strings in its keys and lists. The dictionary is kept in
+redis as two hashes, pair_ids (pair -> id) and pair_names (id -> pair), and mirrored in memory
+with the fields of each pair decoded once. A random token identifies the dictionary, so a mirror
+can tell when the index was flushed and its ids no longer apply.
+"""
+
+import threading
+from uuid import uuid4
+
+import numpy as np
+
+
+def pair_fields(pair):
+    """
+    Decode a pair string into its fields
+
+    :type pair: string
+    :param pair: symbol pair as produced by SymbolTree.get_pairs
+
+    :rtype: (string, string, int, int)
+    :return: first symbol, second symbol, horizontal distance, vertical distance
+    """
+    s1, s2, dh, dv = pair.split('|')
+    return s1.replace('!@!', '|'), s2.replace('!@!', '|'), int(dh), int(dv)
+
+
+class PairDictionary(object):
+    """
+    In memory mirror of the pair dictionary of an index
+    """
+    def __init__(self, db):
+        """
+        :type db: StrictRedis
+        :param db: Redis Database connection object
+        """
+        self.db = db
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """
+        (Re)load the whole dictionary from redis
+        """
+        ids = {}
+        pairs = []
+        fields = []
+        pipe = self.db.pipeline(transaction=False)
+        pipe.get('pair_dict_token')
+        pipe.hgetall('pair_names')
+        token, names = pipe.execute()
+        for pair_id, pair in names.iteritems():
+            pair_id = int(pair_id)
+            pair = pair.decode('utf-8')
+            if pair_id >= len(pairs):
+                pairs.extend([None] * (pair_id + 1 - len(pairs)))
+                fields.extend([None] * (pair_id + 1 - len(fields)))
+            ids[pair] = pair_id
+            pairs[pair_id] = pair
+            fields[pair_id] = pair_fields(pair)
+        with self.lock:
+            self.token, self.ids, self.pairs, self.fields = token, ids, pairs, fields
+
+    def refresh(self):
+        """
+        Reload the dictionary if the index was flushed since it was loaded
+
+        :rtype: bool
+        :return: True if the dictionary was reloaded
+        """
+        if self.db.get('pair_dict_token') != self.token:
+            self.load()
+            return True
+        return False
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def register(self, pair_id, pair):
+        """
+        Add a pair known to be in redis to the in memory dictionary
+        """
+        with self.lock:
+            if pair_id >= len(self.pairs):
+                self.pairs.extend([None] * (pair_id + 1 - len(self.pairs)))
+                self.fields.extend([None] * (pair_id + 1 - len(self.fields)))
+            self.pairs[pair_id] = pair
+            self.fields[pair_id] = pair_fields(pair)
+            self.ids[pair] = pair_id
+
+    def lookup(self, pairs):
+        """
+        Return the ids of the pairs and the horizontal distance of each id
+
+        Pairs that are not in the index get negative ids that are only meaningful within the
+        returned values.
+
+        :type pairs: list
+        :param pairs: list of symbol pairs
+
+        :rtype: (list(int), dict(int,int))
+        :return: pair ids and horizontal distance of each pair id
+        """
+        # Pairs may have been added by another process since the dictionary was loaded.
+        missing = list(set(p for p in pairs if p not in self.ids))
+        if missing:
+            for pair, pair_id in zip(missing, self.db.hmget('pair_ids', missing)):
+                if pair_id is not None:
+                    self.register(int(pair_id), pair)
+
+        unknown = {}
+        ids = []
+        distances = {}
+        for pair in pairs:
+            pair_id = self.ids.get(pair)
+            if pair_id is None:
+                pair_id = unknown.setdefault(pair, -1 - len(unknown))
+                distances[pair_id] = pair_fields(pair)[2]
+            else:
+                distances[pair_id] = self.fields[pair_id][2]
+            ids.append(pair_id)
+        return ids, distances
+
+    def assign(self, pairs):
+        """
+        Return the ids of the pairs, adding the pairs that are not in the index to the dictionary
+
+        :type pairs: list
+        :param pairs: list of symbol pairs
+
+        :rtype: (list(int), dict(int,int))
+        :return: pair ids and horizontal distance of each pair id
+        """
+        ids, distances = self.lookup(pairs)
+        new = []
+        seen = set()
+        for pair, pair_id in zip(pairs, ids):
+            if pair_id < 0 and pair not in seen:
+                seen.add(pair)
+                new.append(pair)
+        if not new:
+            return ids, distances
+
+        if self.token is None:
+            self.db.setnx('pair_dict_token', uuid4().hex)
+            self.token = self.db.get('pair_dict_token')
+
+        # Reserve a block of ids, another process may win the race for some of the pairs.
+        first_id = self.db.incrby('next_pair_id', len(new)) - len(new)
+        pipe = self.db.pipeline(transaction=False)
+        for pair_id, pair in enumerate(new, first_id):
+            pipe.hsetnx('pair_ids', pair, pair_id)
+        for (pair_id, pair), created in zip(enumerate(new, first_id), pipe.execute()):
+            if created:
+                pipe.hset('pair_names', pair_id, pair)
+        pipe.hmget('pair_ids', new)
+        for pair, pair_id in zip(new, pipe.execute()[-1]):
+            self.register(int(pair_id), pair)
+        return self.lookup(pairs)
+
+    def name(self, pair_id):
+        """
+        Return the pair string of a pair id
+        """
+        return self.pairs[pair_id]
+
+    def distance_array(self):
+        """
+        Return the horizontal distance of every pair id, for vectorized score computations
+
+        :rtype: numpy.ndarray
+        :return: horizontal distance indexed by pair id
+        """
+        return np.fromiter((f[2] if f else 1 for f in self.fields), np.float64, len(self.fields))
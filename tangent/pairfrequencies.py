@@ -0,0 +1,96 @@
+"""
+    Tangent
+    Copyright (c) 2013 David Stalnaker, Richard Zanibbi
+
+    This file is part of Tangent.
+
+    Tanget is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Tangent is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Tangent.  If not, see <http://www.gnu.org/licenses/>.
+
+    Contact:
+        - David Stalnaker: david.stalnaker@gmail.com
+        - Richard Zanibbi: rlaz@cs.rit.edu
+"""
+
+"""
+In memory table of the frequency of every pair, used to weight the pairs of a query
+
+The writers keep the number of postings of each pair in the pair_counts hash. A search node loads
+the whole hash, together with the number of expressions, and reloads it only when the index
+generation changes, so frequencies never require fetching posting lists.
+"""
+
+import threading
+
+import numpy as np
+
+
+class PairFrequencies(object):
+    """
+    In memory mirror of the pair_counts hash and of the number of expressions of an index
+    """
+    def __init__(self, db):
+        """
+        :type db: StrictRedis
+        :param db: Redis Database connection object
+        """
+        self.db = db
+        self.lock = threading.Lock()
+        self.generation = None
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.num_exprs = 0
+
+    def load(self):
+        """
+        (Re)load the table from redis
+        """
+        # Read everything in one transaction so the counts match the generation.
+        pipe = self.db.pipeline()
+        pipe.get('index_generation')
+        pipe.get('next_expr_id')
+        pipe.hgetall('pair_counts')
+        generation, last_id, counts = pipe.execute()
+
+        # Pairs missing from the hash, as in indexes written before it existed, are marked -1.
+        pair_ids = np.fromiter((int(p) for p in counts.iterkeys()), np.int64, len(counts))
+        table = np.full(pair_ids.max() + 1 if len(pair_ids) else 0, -1, dtype=np.int64)
+        table[pair_ids] = np.fromiter((int(c) for c in counts.itervalues()), np.int64, len(counts))
+        with self.lock:
+            self.generation = int(generation or 0)
+            self.num_exprs = int(last_id or 0) + 1
+            self.counts = table
+
+    def refresh(self):
+        """
+        Reload the table if the index changed since it was loaded
+
+        :rtype: bool
+        :return: True if the table was reloaded
+        """
+        if self.generation is None or int(self.db.get('index_generation') or 0) != self.generation:
+            self.load()
+            return True
+        return False
+
+    def lookup(self, pair_ids):
+        """
+        Return the frequency of each pair
+
+        :type pair_ids: list(int)
+        :param pair_ids: ids of indexed pairs
+
+        :rtype: list(int)
+        :return: number of postings of each pair, None for pairs missing from the table
+        """
+        counts = self.counts
+        return [int(counts[p]) if p < len(counts) and counts[p] >= 0 else None for p in pair_ids]
@@ -0,0 +1,103 @@
+"""
+    Tangent
+    Copyright (c) 2013 David Stalnaker, Richard Zanibbi
+
+    This file is part of Tangent.
+
+    Tanget is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Tangent is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Tangent.  If not, see <http://www.gnu.org/licenses/>.
+
+    Contact:
+        - David Stalnaker: david.stalnaker@gmail.com
+        - Richard Zanibbi: rlaz@cs.rit.edu
+"""
+
+"""
+Compressed posting lists
+
+A posting list is the sorted list of expression ids containing a pair, with an id repeated once per
+occurrence of the pair in the expression. It is stored as the differences between consecutive ids,
+each written as a little endian base 128 varint (7 bits per byte, high bit set on all but the last
+byte of a value). Since ids only grow, new postings are appended to the end of the blob given the
+last id already in it.
+"""
+
+import numpy as np
+
+
+def encode_postings(ids, last=0):
+    """
+    Encode sorted expression ids
+
+    :type ids: list(int)
+    :param ids: sorted expression ids
+
+    :type last: int
+    :param last: last id of the blob the result will be appended to
+
+    :rtype: str
+    :return: encoded postings
+    """
+    deltas = np.diff(np.concatenate(([last], np.asarray(ids, dtype=np.int64))))
+
+    # Number of 7 bit groups needed by each delta.
+    lengths = np.ones(len(deltas), dtype=np.int64)
+    rest = deltas >> 7
+    while rest.any():
+        lengths += rest > 0
+        rest >>= 7
+
+    # Position of each output byte within its value.
+    starts = np.cumsum(lengths) - lengths
+    positions = np.arange(lengths.sum()) - np.repeat(starts, lengths)
+    data = (np.repeat(deltas, lengths) >> (7 * positions)) & 0x7f
+    data[positions < np.repeat(lengths - 1, lengths)] |= 0x80
+    return data.astype(np.uint8).tostring()
+
+
+def decode_postings(blob):
+    """
+    Decode a blob of postings into an array of expression ids
+
+    :type blob: str
+    :param blob: encoded postings, or None for an empty list
+
+    :rtype: numpy.ndarray
+    :return: sorted expression ids
+    """
+    if not blob:
+        return np.zeros(0, dtype=np.int64)
+    data = np.frombuffer(blob, dtype=np.uint8)
+    ends = (data & 0x80) == 0
+
+    # Find the value each byte belongs to, and its position within the value.
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    values = np.cumsum(ends) - ends
+    positions = np.arange(len(data)) - starts[values]
+    groups = (data & 0x7f).astype(np.int64) << (7 * positions)
+    return np.cumsum(np.add.reduceat(groups, starts))
+
+
+def count_postings(blob):
+    """
+    Return the number of postings in a blob without decoding it
+
+    :type blob: str
+    :param blob: encoded postings, or None for an empty list
+
+    :rtype: int
+    :return: number of postings
+    """
+    if not blob:
+        return 0
+    return int(np.count_nonzero((np.frombuffer(blob, dtype=np.uint8) & 0x80) == 0))
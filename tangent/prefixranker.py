@@ -31,12 +31,12 @@ PARTIAL_MATCH_CONSTANT = 0.5
 class PrefixRanker(object):
 
     @staticmethod
-    def search_score(search_pairs, pair_counts=None, total_exprs=None):
+    def search_score(search_pairs, pair_counts=None, total_exprs=None, distances=None):
         """
         Score for search pairs is the the length of search pairs
 
         :type search_pairs: list
-        :param search_pairs: list of symbol pairs
+        :param search_pairs: list of symbol pair ids
 
         :rtype: double
         :return: score for this expression
@@ -48,12 +48,12 @@ class PrefixRanker(object):
     fetch_paths = True
 
     @staticmethod
-    def rank(match_pairs, search_score, result_score, pair_counts, total_exprs, search_paths):
+    def rank(match_pairs, search_score, result_score, pair_counts, total_exprs, search_paths, distances=None):
         """
         Returns prefix based score
 
         :type match_pairs: list
-        :param match_pairs list of pairs that latched
+        :param match_pairs list of pair ids that latched
 
         :type search_score: double
         :param search_score: score for pairs in query
@@ -62,15 +62,18 @@ class PrefixRanker(object):
         :param result_score: score for pairs that matched
 
 
-        :type pair_counts: dict(str,int)
+        :type pair_counts: dict(int,int)
         :param pair_counts: frequency for each symbol pair
 
         :type total_exprs:
         :param total_exprs:
 
-        :type search_paths:dict(str,list)
+        :type search_paths:dict(int,list)
         :param: search_paths:given two symbol pairs, the path between them
 
+        :type distances: dict(int,int)
+        :param distances: horizontal distance of each symbol pair
+
         :rtype: double
         :return: score
 
@@ -22,25 +22,79 @@
         - Richard Zanibbi: rlaz@cs.rit.edu
 """
 from __future__ import division
-from collections import Counter, defaultdict
-from operator import itemgetter
+from collections import defaultdict
 from itertools import izip_longest
 from random import randint
-import urllib
-import re
+import json
+import time
 
 import redis
 
-from tangent import Index, Result, FMeasureRanker, DistanceRanker, RecallRanker, PrefixRanker, TfIdfRanker, EverythingRanker, TfIdfPrefixRanker
+from tangent import Index, Result, LRUCache, BloomFilter, PairDictionary, PairFrequencies, SecondPass, encode_postings, decode_postings, FMeasureRanker, all_rankers
 
 class RedisIndex(Index):
-    def __init__(self, ranker=None, db=0):
-        self.r = redis.StrictRedis(db=db)
+    def __init__(self, ranker=None, db=0, result_cache_size=1000, window=None, connection=None,
+                 max_connections=None):
+        """
+        :type window: (int, int)
+        :param window: maximum horizontal distance and nesting depth of the pairs of a new index
+            (None for no limit); an existing index keeps the window it was built with
+
+        :type connection: StrictRedis
+        :param connection: redis client to use instead of connecting to database db, such as a
+            MemoryRedis
+
+        :type max_connections: int
+        :param max_connections: size of the connection pool shared by concurrent searches, which
+            wait for a free connection once it is exhausted; None for an unbounded pool
+        """
+        if connection is not None:
+            self.r = connection
+        elif max_connections:
+            self.r = redis.StrictRedis(connection_pool=redis.BlockingConnectionPool(
+                db=db, max_connections=max_connections))
+        else:
+            self.r = redis.StrictRedis(db=db)
         if ranker:
             self.ranker = ranker
         else:
             self.ranker = FMeasureRanker()
-        self.all_rankers = [FMeasureRanker(), DistanceRanker(), RecallRanker(), PrefixRanker(), TfIdfRanker(), EverythingRanker(), TfIdfPrefixRanker()]
+        self.all_rankers = all_rankers()
+        self.result_cache = LRUCache(result_cache_size) if result_cache_size else None
+        self.pair_dict = PairDictionary(self.r)
+        self.frequencies = PairFrequencies(self.r)
+        self.requested_window = window
+        self.load_window()
+        self.load_tree_keys()
+
+    def load_window(self):
+        """
+        Use the pair window recorded in the index, or the requested one for a new index
+        """
+        stored = self.r.get('pair_window')
+        if stored is None:
+            self.window = self.requested_window
+            return
+        window = json.loads(stored)
+        self.window = tuple(window) if window is not None else None
+        if self.requested_window is not None and self.requested_window != self.window:
+            raise ValueError('index was built with pair window %s' % (self.window,))
+
+    def load_tree_keys(self):
+        """
+        Key exact search by tree fingerprint, unless the index was built with the full tree strings
+        as keys before fingerprints were introduced
+        """
+        self.legacy_tree_keys = (self.r.get('tree_keys') is None and
+                                 bool(self.r.exists('next_expr_id')))
+
+    def refresh(self):
+        if self.pair_dict.refresh():
+            self.load_window()
+            self.load_tree_keys()
+
+    def generation(self):
+        return int(self.r.get('index_generation') or 0)
 
     def random(self):
         """
@@ -63,147 +117,429 @@ class RedisIndex(Index):
 
 
         """
+        self.refresh()
+        self.mark_new_index()
+
         # Check if expression is in the index.
-        existing_id = self.exact_search(tree)
+        key = self.tree_key(tree)
+        existing_id = self.lookup_trees([key])[0]
+        pipe = self.r.pipeline()
         if existing_id:
             # Just add the document name to the existing expression.
-            self.r.sadd('expr:%s:doc' % existing_id, tree.document)
+            pipe.sadd('expr:%s:doc' % existing_id, tree.document)
         else:
             # Get a unique id for the expression.
             expr_id = self.r.incr('next_expr_id')
+            postings = defaultdict(list)
+            self.write_expression(pipe, expr_id, tree, key, postings)
+            self.write_postings(pipe, postings)
 
-            pairs = tree.get_pairs(get_paths=True)
-            pipe = self.r.pipeline()
+        # Invalidate cached search results.
+        pipe.incr('index_generation')
+        pipe.execute()
 
-            # Insert the source text and number of pairs of the expression.
-            pipe.set('expr:%d:mathml' % expr_id, tree.mathml)
-            pipe.set('expr:%d:latex' % expr_id, tree.latex)
-            pipe.sadd('expr:%d:doc' % expr_id, tree.document)
+    def add_all(self, trees, batch_size=1000, bloom_capacity=1000000):
+        """
+        Add symbol trees to the index, writing batch_size expressions per pipeline
 
-            # Add the max result score for each ranker.
-            for ranker in self.all_rankers:
-                score = ranker.search_score(pairs[0])
-                pipe.set('expr:%d:%s' % (expr_id, ranker.result_score_key),
-                         score)
+        The fingerprints of the indexed expressions are loaded into a Bloom filter, so exact search
+        lookups are only needed for the trees that may already be in the index. Ids for the new
+        expressions of a batch are reserved with a single INCRBY, so each batch costs at most
+        three round trips. Like write_postings, this requires a single writer.
 
-            # Create an index from tree to its id, so we can do exact search.
-            pipe.set(u'tree:%s' % tree.build_repr(), expr_id)
-            
-            # Insert each pair in the inverted lists.
-            for pair, path in zip(*pairs):
-                pipe.lpush('pair:%s:exprs' % pair, expr_id)
-                pipe.lpush('pair:%s:paths' % pair, path)
+        :type trees: iterable(SymbolTree)
+        :param trees: Symbol Trees
 
-            # Create set of all pairs.
-            for pair, path in zip(*pairs):
-                pipe.rpush('expr:%d:all_pairs' % expr_id, pair)
-                pipe.rpush('expr:%d:all_paths' % expr_id, path)
-                pipe.sadd('all_pairs', pair)
+        :type batch_size: int
+        :param batch_size: number of trees written per pipeline
 
-            pipe.execute()
+        :type bloom_capacity: int
+        :param bloom_capacity: number of distinct expressions the Bloom filter is sized for, on top
+            of the ones already in the index
 
-    def search(self, search_tree):
+        :rtype: int
+        :return: number of new expressions added
+        """
+        self.refresh()
+        self.mark_new_index()
+        seen = None if self.legacy_tree_keys else self.load_fingerprints(bloom_capacity)
+        batch = []
+        num_added = 0
+        num_trees = 0
+        start = time.time()
+        for tree in trees:
+            batch.append(tree)
+            if len(batch) >= batch_size:
+                num_added += self.add_batch(batch, seen)
+                num_trees += len(batch)
+                batch = []
+                elapsed = time.time() - start
+                print('indexed %d expressions, %d new (%.0f expressions/sec)' %
+                      (num_trees, num_added, num_trees / elapsed if elapsed else 0))
+        if batch:
+            num_added += self.add_batch(batch, seen)
+        return num_added
+
+    def mark_new_index(self):
         """
-        Return all matches for this search tree
+        Record the pair window and the exact search keys of a new index
+        """
+        self.r.setnx('pair_window', json.dumps(self.window))
+        if not self.legacy_tree_keys:
+            self.r.setnx('tree_keys', 'fingerprint')
 
-        :type search_tree: SymbolTree
-        :param search_tree:Symbol Tree
+    def load_fingerprints(self, capacity):
+        """
+        Return a Bloom filter of the fingerprints of the expressions in the index
 
+        :type capacity: int
+        :param capacity: number of expressions expected to be added
+
+        :rtype: BloomFilter
+        :return: Bloom filter of the indexed fingerprints
+        """
+        seen = BloomFilter(capacity + self.r.hlen('tree_ids'))
+        chunk = []
+        for fingerprint, _ in self.r.hscan_iter('tree_ids', count=10000):
+            chunk.append(fingerprint)
+            if len(chunk) >= 10000:
+                seen.add(chunk)
+                chunk = []
+        seen.add(chunk)
+        return seen
+
+    def add_batch(self, trees, seen):
+        """
+        Add a batch of symbol trees in one pipeline
 
-        :rtype: list[Result]
-        :return: list of search results
+        :type trees: list(SymbolTree)
+        :param trees: Symbol Trees
 
+        :type seen: BloomFilter
+        :param seen: fingerprints of the indexed expressions, updated in place; None to look up
+            every tree
+
+        :rtype: int
+        :return: number of new expressions added
         """
-        
-        matches = defaultdict(list)
-        pair_counts = dict()
-        total_exprs = int(self.r.get('next_expr_id')) + 1
-        pipe = self.r.pipeline()
+        keys = [self.tree_key(tree) for tree in trees]
+
+        # Look up the trees that may be in the index, in order of first occurrence so the new
+        # expressions are written in increasing id order.
+        distinct = []
+        distinct_set = set()
+        for key in keys:
+            if key not in distinct_set:
+                distinct_set.add(key)
+                distinct.append(key)
+        maybe = seen.contains(distinct) if seen is not None else [True] * len(distinct)
+        candidates = [key for key, m in zip(distinct, maybe) if m]
+        known_ids = {}
+        for key, existing_id in zip(candidates, self.lookup_trees(candidates)):
+            if existing_id:
+                known_ids[key] = int(existing_id)
+        new = [key for key in distinct if key not in known_ids]
+
+        # Reserve a block of ids for the new expressions, and ids for all of their pairs.
+        if new:
+            last_id = self.r.incrby('next_expr_id', len(new))
+            for expr_id, key in enumerate(new, last_id - len(new) + 1):
+                known_ids[key] = expr_id
+            new_pairs = []
+            for tree in trees:
+                tree.compute_pairs(self.window)
+                new_pairs.extend(tree.get_pairs(window=self.window))
+            self.pair_dict.assign(new_pairs)
+            if seen is not None:
+                seen.add(new)
+
+        # Write each new expression once, and only record the document of duplicates.
+        pending = set(new)
+        postings = defaultdict(list)
+        pipe = self.r.pipeline(transaction=False)
+        for tree, key in zip(trees, keys):
+            if key in pending:
+                self.write_expression(pipe, known_ids[key], tree, key, postings)
+                pending.discard(key)
+            else:
+                pipe.sadd('expr:%d:doc' % known_ids[key], tree.document)
+        self.write_postings(pipe, postings)
+        pipe.incr('index_generation')
+        pipe.execute()
+        return len(new)
+
+    def write_expression(self, pipe, expr_id, tree, key, postings):
+        """
+        Queue the commands that insert a new expression in the index
 
-        search_pairs, paths = search_tree.get_pairs(get_paths=True)
-        search_paths = defaultdict(list)
-        for pair, path in zip(search_pairs, paths):
-            search_paths[pair].append(path)
-        search_pair_counts = Counter(search_pairs).items()
-        
-        # Get expressions that contain each pair and count them.
-        if self.ranker.fetch_paths:
-            pipe2 = self.r.pipeline()
-            for pair, count in search_pair_counts:
-                pipe.lrange('pair:%s:exprs' % pair, 0, -1)
-                pipe2.lrange('pair:%s:paths' % pair, 0, -1)
-            for (pair, count), expressions, paths in zip(search_pair_counts,
-                                                         pipe.execute(),
-                                                         pipe2.execute()):
-                pair_counts[pair] = len(expressions)
-                for e, path in zip(expressions, paths):
-                    matches[int(e)].append((pair, path))
+        The expression ids of its pairs are collected in postings, to be appended to the posting
+        lists by write_postings.
+
+        :type pipe: StrictPipeline
+        :param pipe: Redis pipeline
+
+        :type expr_id: int
+        :param expr_id: id of the new expression
+
+        :type tree: SymbolTree
+        :param tree:Symbol Tree
+
+        :type key: str
+        :param key: exact search key of the tree, as returned by tree_key
+
+        :type postings: dict(int,list(int))
+        :param postings: new expression ids of each pair id, updated in place
+        """
+        pairs, paths = tree.get_pairs(get_paths=True, window=self.window)
+        pair_ids, distances = self.pair_dict.assign(pairs)
+
+        # Insert the source text and number of pairs of the expression.
+        pipe.set('expr:%d:mathml' % expr_id, tree.mathml)
+        pipe.set('expr:%d:latex' % expr_id, tree.latex)
+        pipe.sadd('expr:%d:doc' % expr_id, tree.document)
+
+        # Add the max result score for each ranker.
+        for ranker in self.all_rankers:
+            score = ranker.search_score(pair_ids, distances=distances)
+            pipe.set('expr:%d:%s' % (expr_id, ranker.result_score_key),
+                     score)
+
+        # Create an index from tree to its id, so we can do exact search.
+        if self.legacy_tree_keys:
+            pipe.set(u'tree:%s' % key, expr_id)
         else:
-            for pair, count in search_pair_counts:
-                pipe.lrange('pair:%s:exprs' % pair, 0, -1)
-            for (pair, count), expressions in zip(search_pair_counts,
-                                                  pipe.execute()):
-                pair_counts[pair] = len(expressions)
-                prev = None
-                for e in expressions:
-                    match_count = match_count + 1 if e == prev else 1
-                    if match_count <= count:
-                        matches[int(e)].append(pair)
-                    prev = e
-
-
-        # Get number of pairs in each matched expression.
-        for expr_id in matches.keys():
+            pipe.hset('tree_ids', key, expr_id)
+
+        # Insert each pair in the inverted lists, the paths are kept in the order of the postings.
+        for pair_id, path in zip(pair_ids, paths):
+            postings[pair_id].append(expr_id)
+            pipe.rpush('pair:%d:paths' % pair_id, path)
+
+        # Create list of all pairs.
+        if pair_ids:
+            pipe.rpush('expr:%d:all_pairs' % expr_id, *pair_ids)
+            pipe.rpush('expr:%d:all_paths' % expr_id, *paths)
+
+    def write_postings(self, pipe, postings):
+        """
+        Queue the commands that append new expression ids to the compressed posting lists
+
+        Ids are delta encoded against the last id of each list, which is kept in the pair_last
+        hash. This requires expressions to be written in increasing id order by a single writer.
+        The frequency of each pair is kept in the pair_counts hash, and the number of new postings
+        of each pair is added to the pair_deltas hash read by the incremental second pass.
+
+        :type pipe: StrictPipeline
+        :param pipe: Redis pipeline
+
+        :type postings: dict(int,list(int))
+        :param postings: new expression ids of each pair id, in increasing order
+        """
+        if not postings:
+            return
+        pair_ids = postings.keys()
+        last_ids = {}
+        for pair_id, last in zip(pair_ids, self.r.hmget('pair_last', pair_ids)):
+            ids = postings[pair_id]
+            pipe.append('pair:%d:exprs' % pair_id, encode_postings(ids, int(last or 0)))
+            pipe.hincrby('pair_counts', pair_id, len(ids))
+            pipe.hincrby('pair_deltas', pair_id, len(ids))
+            last_ids[pair_id] = ids[-1]
+        pipe.hmset('pair_last', last_ids)
+
+    def total_exprs(self):
+        """
+        Return the number of expressions in the index, as used by the frequency based rankers
+
+        This also reloads the pair frequencies when the index changed, so they describe the same
+        index as the returned count.
+
+        :rtype: int
+        :return: number of expressions
+        """
+        self.frequencies.refresh()
+        return self.frequencies.num_exprs
+
+    def lookup_pairs(self, pairs):
+        """
+        Return the ids of the pairs and the horizontal distance of each id
+
+        :type pairs: list
+        :param pairs: list of symbol pairs
+
+        :rtype: (list(int), dict(int,int))
+        :return: pair ids, negative for pairs that are not in the index, and horizontal distances
+        """
+        return self.pair_dict.lookup(pairs)
+
+    def pair_frequencies(self, pair_ids):
+        """
+        Return the frequency of each pair from the in memory table
+
+        :type pair_ids: list(int)
+        :param pair_ids: ids of indexed pairs
+
+        :rtype: list(int)
+        :return: number of postings of each pair, None where the table does not know it
+        """
+        if self.frequencies.generation is None:
+            self.frequencies.load()
+        return self.frequencies.lookup(pair_ids)
+
+    def fetch_postings(self, pair_ids, fetch_paths=False):
+        """
+        Return the posting list of each pair
+
+        :type pair_ids: list(int)
+        :param pair_ids: ids of indexed pairs
+
+        :type fetch_paths: bool
+        :param fetch_paths: also return the path of each posting
+
+        :rtype: list((numpy.ndarray, list))
+        :return: expression ids and paths (None unless requested) of each pair
+        """
+        pipe = self.r.pipeline()
+        for pair_id in pair_ids:
+            pipe.get('pair:%d:exprs' % pair_id)
+            if fetch_paths:
+                pipe.lrange('pair:%d:paths' % pair_id, 0, -1)
+        replies = pipe.execute()
+        if fetch_paths:
+            return [(decode_postings(blob), paths) for blob, paths in zip(replies[::2], replies[1::2])]
+        return [(decode_postings(blob), None) for blob in replies]
+
+    def result_scores(self, expr_ids):
+        """
+        Return the result score of the ranker for each expression
+
+        :type expr_ids: list(int)
+        :param expr_ids: expression ids
+
+        :rtype: list(float)
+        :return: result score of each expression
+        """
+        pipe = self.r.pipeline()
+        for expr_id in expr_ids:
             pipe.get('expr:%d:%s' % (expr_id, self.ranker.result_score_key))
-        result_scores = [float(x) for x in pipe.execute()]
-
-        # Get max score for the search term
-        search_score = self.ranker.search_score(search_pairs, pair_counts,
-                                                total_exprs)
-
-        # Calculate a score for each matched expression.
-        ranked_matches = ((expr_id, 
-                           self.ranker.rank(match_pairs, search_score,
-                                            result_score, pair_counts,
-                                            total_exprs, search_paths),
-                           match_pairs)
-                          for (expr_id, match_pairs), result_score
-                          in zip(matches.items(), result_scores))
-        
-        # Sort the results, and get additional information for the top results.
-        results = []
-        for expr_id, count, match_pairs in sorted(ranked_matches, reverse=True,
-                                                  key=itemgetter(1))[:10]:
-            results.append(Result(latex=self.r.get('expr:%s:latex' % expr_id),
-                                  score=count,
-                                  debug_info=['Pairs: %s' % match_pairs],
-                                  links=self.get_document_links(expr_id),
-                                  expr_id=expr_id))
-        return results, len(matches), pair_counts
-
-    def second_pass(self):
+        return [float(x) for x in pipe.execute()]
+
+    def get_latex(self, expr_id):
+        """
+        Return the tex of an expression
+        """
+        return self.r.get('expr:%s:latex' % expr_id)
+
+    def second_pass(self, incremental=False, max_growth=0.1, statistics=None, max_weight_change=0.04):
         """
         Apply any post calculation required by rankers
+
+        :type incremental: bool
+        :param incremental: only rescore the new expressions and the ones containing pairs whose
+            weight changed since the last pass, unless the index grew by more than max_growth since
+            the last full pass
+
+        :type max_growth: float
+        :param max_growth: growth of the index, as a fraction of its size at the last full pass,
+            that forces a full pass
+
+        :type statistics: (numpy.ndarray, int)
+        :param statistics: frequency of each pair id and number of expressions of the whole
+            collection, for a shard of a ShardedIndex
+
+        :type max_weight_change: float
+        :param max_weight_change: change of the weight of a pair above which an incremental pass
+            rescores the expressions containing it
+
+        :rtype: bool
+        :return: True if every expression was rescored
         """
-        for ranker in self.all_rankers:
-            try:
-                ranker.second_pass(self.r)
-            except AttributeError:
-                # Ranker does not have a second pass method, so do nothing.
-                pass
+        # Only rankers whose result score depends on pair frequencies take part.
+        rankers = [ranker for ranker in self.all_rankers if hasattr(ranker, 'pair_weights')]
+        full = SecondPass(self.r, self.pair_dict, rankers,
+                          max_growth=max_growth,
+                          max_weight_change=max_weight_change).run(incremental, statistics)
+        generation = self.r.incr('index_generation')
+        # Incremental passes leave the scores of untouched expressions based on an older
+        # expression count, which pruning cannot rely on.
+        if full:
+            self.r.set('second_pass_generation', generation)
+        return full
+
+    def scores_current(self):
+        """
+        Return True if the index has not changed since the last second pass
+        """
+        return self.r.get('second_pass_generation') == str(self.generation())
+
+    def min_pair_weight(self):
+        # Recorded by the second pass, indexes scored before it was recorded cannot be pruned.
+        weight = self.r.hget('second_pass', 'min_weight:%s' % self.ranker.result_score_key)
+        return float(weight) if weight is not None else None
 
-    def exact_search(self, search_tree):
+    def tree_key(self, tree):
         """
-        Return symbols in symbol tree in index if any
+        Return the exact search key of a tree: its fingerprint, or its string in legacy indexes
 
-        :type search_tree:str
-        :param search_tree: symbol pair
+        :type tree: SymbolTree
+        :param tree: Symbol Tree
 
-        :rtype: string
-        :return: symbol path of tree
+        :rtype: str
+        :return: exact search key
+        """
+        return tree.build_repr() if self.legacy_tree_keys else tree.fingerprint()
 
+    def lookup_trees(self, keys):
         """
-        return self.r.get(u'tree:%s' % search_tree.build_repr())
+        Return the id of the expression of each exact search key
+
+        Fingerprints are fields of the tree_ids hash, legacy indexes have one tree:<string> key
+        per expression.
+
+        :type keys: list(str)
+        :param keys: exact search keys
+
+        :rtype: list(str)
+        :return: expression id of each key, None for trees that are not in the index
+        """
+        if not keys:
+            return []
+        if not self.legacy_tree_keys:
+            return self.r.hmget('tree_ids', keys)
+        pipe = self.r.pipeline(transaction=False)
+        for key in keys:
+            pipe.get(u'tree:%s' % key)
+        return pipe.execute()
+
+    def exact_match(self, search_tree):
+        existing_id = self.lookup_trees([self.tree_key(search_tree)])[0]
+        return int(existing_id) if existing_id else None
+
+    def fetch_results(self, expr_ids):
+        """
+        Return the tex, documents and optionally mathml of each expression with one pipeline
+
+        Documents are sorted, and cut to max_links by redis when a limit is set.
+
+        :type expr_ids: list(int)
+        :param expr_ids: expression ids
+
+        :rtype: list((str,list(str),str))
+        :return: tex, documents and mathml (None unless fetch_mathml is set) of each expression
+        """
+        pipe = self.r.pipeline(transaction=False)
+        for expr_id in expr_ids:
+            pipe.get('expr:%d:latex' % expr_id)
+            if self.max_links is None:
+                pipe.sort('expr:%d:doc' % expr_id, alpha=True)
+            else:
+                pipe.sort('expr:%d:doc' % expr_id, start=0, num=self.max_links, alpha=True)
+            if self.fetch_mathml:
+                pipe.get('expr:%d:mathml' % expr_id)
+        values = pipe.execute()
+        step = 3 if self.fetch_mathml else 2
+        return [(values[i], values[i + 1], values[i + 2] if self.fetch_mathml else None)
+                for i in xrange(0, len(values), step)]
 
     def get_document_links(self, expr_id):
         """
@@ -218,19 +554,3 @@ class RedisIndex(Index):
         """
         docs = self.r.smembers('expr:%s:doc' % expr_id)
         return [self.create_document_link(d) for d in docs]
-
-    def create_document_link(self, path):
-        """
-        Given the path of the document, return the direct wikipedia link and the name of the article
-
-        :type path:str
-        :param path:wikipedia link
-
-        :rtype: (str,str)
-        :return: wikipedia link and title of article
-        """
-        match = re.search(r'([^/]*)\.mml', path)
-        if match:
-            return 'http://en.wikipedia.org/w/index.php?search=%s&go=Go' % urllib.quote(match.group(1)), 'Wikipedia - ' + match.group(1)
-        else:
-            return path, path
@@ -0,0 +1,250 @@
+"""
+    Tangent
+    Copyright (c) 2013 David Stalnaker, Richard Zanibbi
+
+    This file is part of Tangent.
+
+    Tanget is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Tangent is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Tangent.  If not, see <http://www.gnu.org/licenses/>.
+
+    Contact:
+        - David Stalnaker: david.stalnaker@gmail.com
+        - Richard Zanibbi: rlaz@cs.rit.edu
+"""
+
+"""
+Second pass over the index that computes the result scores which depend on pair frequencies
+
+An incremental pass rescores the expressions added since the watermark of the last pass, and the
+ones containing a pair whose weight moved by more than max_weight_change. Writers count the new
+postings of each pair in the pair_deltas hash; smaller changes are carried over to the next pass.
+"""
+
+from itertools import izip
+import time
+
+import numpy as np
+
+from tangent import count_postings, decode_postings
+
+
+class SecondPass(object):
+    """
+    Computes the result score key of several rankers with one scan over the expressions
+    """
+    def __init__(self, db, pair_dict, rankers, batch_size=1000, max_growth=0.1,
+                 max_weight_change=0.04):
+        """
+        :type db: StrictRedis
+        :param db: Redis Database connection object
+
+        :type pair_dict: PairDictionary
+        :param pair_dict: pair dictionary of the index
+
+        :type rankers: list
+        :param rankers: rankers defining pair_weights
+
+        :type batch_size: int
+        :param batch_size: number of expressions fetched and written per pipeline
+
+        :type max_growth: float
+        :param max_growth: growth of the index since the last full pass, as a fraction of its size
+            then, above which incremental passes rescore every expression
+
+        :type max_weight_change: float
+        :param max_weight_change: change of the weight of a pair, for any ranker, above which
+            incremental passes rescore the expressions containing it; the default is about the
+            change of idf weights max_growth allows, log10(1.1)
+        """
+        self.db = db
+        self.pair_dict = pair_dict
+        self.rankers = rankers
+        self.batch_size = batch_size
+        self.max_growth = max_growth
+        self.max_weight_change = max_weight_change
+
+    def run(self, incremental=False, statistics=None):
+        """
+        Update the result score of every expression for each ranker, or with incremental only of
+        the new expressions and of the ones containing a pair whose weight changed
+
+        :type incremental: bool
+        :param incremental: rescore only the affected expressions, unless the index grew too much
+
+        :type statistics: (numpy.ndarray, int)
+        :param statistics: frequency of each pair id and number of expressions in a whole
+            collection, for indexes holding a part of it; every expression is rescored
+
+        :rtype: bool
+        :return: True if every expression was rescored
+        """
+        if not self.rankers:
+            return True
+
+        # Take the deltas recorded so far, the ones recorded from now on are left for the next
+        # pass. The deltas of a pass that failed are still in pair_deltas:pass, and are taken
+        # first. Writers only add deltas, so pair_deltas cannot disappear before it is renamed.
+        if not self.db.exists('pair_deltas:pass') and self.db.exists('pair_deltas'):
+            self.db.rename('pair_deltas', 'pair_deltas:pass')
+        pipe = self.db.pipeline()
+        pipe.hgetall('pair_deltas:pass')
+        pipe.exists('dirty_pairs')
+        pipe.hgetall('second_pass')
+        pipe.get('next_expr_id')
+        deltas, legacy, watermark, last_id = pipe.execute()
+        num_exprs = int(last_id or 0) + 1
+
+        # Indexes written before pair_deltas recorded the changed pairs without their deltas.
+        full = (not incremental or statistics is not None or legacy or
+                'full_exprs' not in watermark or
+                num_exprs > int(watermark['full_exprs']) * (1 + self.max_growth))
+        self.pair_dict.load()
+        distances = self.pair_dict.distance_array()
+        total_exprs = num_exprs
+        carried = {}
+        if statistics is not None:
+            counts, total_exprs = statistics
+            expr_ids = np.arange(num_exprs)
+        elif full:
+            counts = self.count_pairs()
+            expr_ids = np.arange(num_exprs)
+        else:
+            counts = self.load_counts()
+            changed, carried = self.changed_pairs(counts, deltas, distances, total_exprs)
+            new_ids = np.arange(int(watermark['expr_id']) + 1, num_exprs)
+            expr_ids = np.union1d(self.affected_exprs(changed), new_ids)
+        weights = [ranker.pair_weights(counts, distances, total_exprs) for ranker in self.rankers]
+        self.score(expr_ids, weights)
+
+        fields = {
+            'expr_id': num_exprs - 1,
+            'full_exprs': num_exprs if full else watermark['full_exprs'],
+            'mode': 'full' if full else 'incremental',
+            'rescored': len(expr_ids),
+            'time': time.time()
+        }
+        for ranker, w in izip(self.rankers, weights):
+            fields['min_weight:%s' % ranker.result_score_key] = float(w.min()) if len(w) else 0.0
+        pipe = self.db.pipeline()
+        pipe.hmset('second_pass', fields)
+        pipe.delete('pair_deltas:pass', 'dirty_pairs')
+        for pair_id, delta in carried.iteritems():
+            pipe.hincrby('pair_deltas', pair_id, delta)
+        pipe.execute()
+        return full
+
+    def changed_pairs(self, counts, deltas, distances, total_exprs):
+        """
+        Split the pairs whose frequency changed into the ones whose weight moved by more than
+        max_weight_change for some ranker, and the ones whose delta is carried over
+
+        :type counts: numpy.ndarray
+        :param counts: frequency of each pair id
+
+        :type deltas: dict(str,str)
+        :param deltas: number of postings added to each pair id since its expressions were scored
+
+        :type distances: numpy.ndarray
+        :param distances: horizontal distance of each pair id
+
+        :type total_exprs: int
+        :param total_exprs: number of expressions in the index
+
+        :rtype: (list(int), dict(int,int))
+        :return: pair ids to rescore through, and delta of the other pairs
+        """
+        pair_ids = np.array([int(p) for p in deltas], dtype=np.int64)
+        added = np.array([int(d) for d in deltas.itervalues()], dtype=np.float64)
+        before = counts.copy()
+        before[pair_ids] = np.maximum(counts[pair_ids] - added, 0)
+        moved = np.zeros(len(pair_ids), dtype=bool)
+        for ranker in self.rankers:
+            change = np.abs(ranker.pair_weights(counts, distances, total_exprs) -
+                            ranker.pair_weights(before, distances, total_exprs))
+            moved |= change[pair_ids] > self.max_weight_change
+        carried = dict(izip(pair_ids[~moved].tolist(), added[~moved].astype(np.int64).tolist()))
+        return pair_ids[moved].tolist(), carried
+
+    def count_pairs(self):
+        """
+        Count the postings of every pair, and resynchronize the pair_counts hash with the counts,
+        which also fills it in for indexes written before it was introduced
+
+        :rtype: numpy.ndarray
+        :return: frequency of each pair id
+        """
+        pipe = self.db.pipeline(transaction=False)
+        for pair_id in xrange(len(self.pair_dict)):
+            pipe.get('pair:%d:exprs' % pair_id)
+        counts = np.array([count_postings(blob) for blob in pipe.execute()], dtype=np.float64)
+        if len(counts):
+            self.db.hmset('pair_counts', dict(enumerate(counts.astype(np.int64).tolist())))
+        return counts
+
+    def load_counts(self):
+        """
+        Return the frequency of each pair id from the pair_counts hash
+
+        :rtype: numpy.ndarray
+        :return: frequency of each pair id
+        """
+        counts = np.zeros(len(self.pair_dict), dtype=np.float64)
+        for pair_id, count in self.db.hgetall('pair_counts').iteritems():
+            if int(pair_id) < len(counts):
+                counts[int(pair_id)] = int(count)
+        return counts
+
+    def affected_exprs(self, pair_ids):
+        """
+        Return the expressions containing any of the pairs
+
+        :type pair_ids: list(int)
+        :param pair_ids: pair ids
+
+        :rtype: numpy.ndarray
+        :return: sorted expression ids
+        """
+        pipe = self.db.pipeline(transaction=False)
+        for pair_id in pair_ids:
+            pipe.get('pair:%d:exprs' % pair_id)
+        postings = [decode_postings(blob) for blob in pipe.execute()]
+        return np.unique(np.concatenate(postings)) if postings else np.zeros(0, dtype=np.int64)
+
+    def score(self, expr_ids, weights):
+        """
+        Compute and store the result scores of the expressions
+
+        :type expr_ids: numpy.ndarray
+        :param expr_ids: expression ids
+
+        :type weights: list(numpy.ndarray)
+        :param weights: weight of each pair id for each ranker
+        """
+        pipe = self.db.pipeline(transaction=False)
+        for start in xrange(0, len(expr_ids), self.batch_size):
+            batch = expr_ids[start:start + self.batch_size].tolist()
+            for i in batch:
+                pipe.lrange('expr:%d:all_pairs' % i, 0, -1)
+            pair_lists = pipe.execute()
+
+            # Flatten the pair id lists, remembering which expression each pair came from.
+            lengths = np.fromiter((len(pairs) for pairs in pair_lists), np.int64, len(pair_lists))
+            ids = np.fromiter((int(p) for pairs in pair_lists for p in pairs), np.int64,
+                              lengths.sum())
+            owners = np.repeat(np.arange(len(pair_lists)), lengths)
+
+            for ranker, w in izip(self.rankers, weights):
+                scores = np.bincount(owners, weights=w[ids], minlength=len(pair_lists))
+                for i, score in izip(batch, scores.tolist()):
+                    pipe.set('expr:%d:%s' % (i, ranker.result_score_key), score)
+            pipe.execute()
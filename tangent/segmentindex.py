@@ -0,0 +1,438 @@
+"""
+    Tangent
+    Copyright (c) 2013 David Stalnaker, Richard Zanibbi
+
+    This file is part of Tangent.
+
+    Tanget is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Tangent is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Tangent.  If not, see <http://www.gnu.org/licenses/>.
+
+    Contact:
+        - David Stalnaker: david.stalnaker@gmail.com
+        - Richard Zanibbi: rlaz@cs.rit.edu
+"""
+
+"""
+Read-only index stored in a single immutable segment file
+
+A segment is built in memory by SegmentWriter and written once. SegmentIndex maps the file and
+serves queries from NumPy views over the mapping, so opening it does not read the index and no
+server is needed. The file starts with a magic string and a json header giving the dtype, offset
+and length of each section; every section is 8 byte aligned. Sections:
+
+- pairs.offsets, pairs.data: pair strings, sorted by their utf-8 encoding, a pair id is its rank
+- distances: horizontal distance of each pair id
+- postings.offsets, postings.exprs: expression ids of each pair id, in increasing order
+- paths.offsets, paths.data: path of each posting
+- scores.<result_score_key>: result score of each expression for each ranker
+- latex.offsets, latex.data and docs.offsets, docs.data: tex and newline separated documents
+  of each expression
+- fingerprints, fingerprints.exprs: sorted tree fingerprints and the expression id of each
+
+The header also records the pair window the segment was built with, and the smallest pair weight
+of each ranker whose result scores depend on pair frequencies, which decides whether searches can
+be pruned.
+
+As in RedisIndex, expression ids start at 1.
+"""
+
+import json
+import mmap
+import os
+from bisect import bisect_left
+from random import randint
+
+import numpy as np
+
+from tangent import Index, LRUCache, pair_fields, FMeasureRanker, all_rankers
+
+MAGIC = 'TANGENTSEG1\n'
+
+
+class StringStore(object):
+    """
+    Sequence of byte strings stored as an offsets array and a data buffer
+    """
+    def __init__(self, offsets, data, base=0):
+        """
+        :type offsets: numpy.ndarray
+        :param offsets: start of each string and end of the last one, relative to base
+
+        :type data: str or mmap
+        :param data: buffer holding the strings
+
+        :type base: int
+        :param base: position of the first string in data
+        """
+        self.offsets = offsets
+        self.data = data
+        self.base = base
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.base + int(self.offsets[i]):self.base + int(self.offsets[i + 1])]
+
+    def slice(self, start, end):
+        """
+        Return the strings start to end (exclusive)
+        """
+        offsets = (self.offsets[start:end + 1] + self.base).tolist()
+        return [self.data[a:b] for a, b in zip(offsets, offsets[1:])]
+
+
+def string_sections(strings):
+    """
+    Encode strings as the offsets and data sections of a StringStore
+
+    :type strings: list(unicode)
+    :param strings: strings to store
+
+    :rtype: (numpy.ndarray, str)
+    :return: offsets and data
+    """
+    encoded = [s.encode('utf-8') if isinstance(s, unicode) else s for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in encoded], out=offsets[1:])
+    return offsets, ''.join(encoded)
+
+
+class SegmentWriter(object):
+    """
+    Builds a segment in memory from symbol trees and writes it to a file
+    """
+    def __init__(self, rankers=None, window=None):
+        """
+        :type rankers: list
+        :param rankers: rankers whose result scores are stored, all rankers by default
+
+        :type window: (int, int)
+        :param window: maximum horizontal distance and nesting depth of the pairs, None for all pairs
+        """
+        self.rankers = rankers if rankers is not None else all_rankers()
+        self.window = window
+        self.expr_ids = {}
+        self.latex = [None]
+        self.docs = [None]
+        self.expr_pairs = [[]]
+        self.scores = [[0.0] for _ in self.rankers]
+        self.pair_ids = {}
+        self.pairs = []
+        self.distances = {}
+        self.postings = []
+
+    def add(self, tree):
+        """
+        Add symbol tree to the segment
+
+        :type tree: SymbolTree
+        :param tree:Symbol Tree
+
+        :rtype: bool
+        :return: True if the tree is a new expression
+        """
+        fingerprint = tree.fingerprint()
+        expr_id = self.expr_ids.get(fingerprint)
+        if expr_id is not None:
+            self.docs[expr_id].add(tree.document)
+            return False
+
+        expr_id = len(self.latex)
+        self.expr_ids[fingerprint] = expr_id
+        self.latex.append(tree.latex)
+        self.docs.append(set([tree.document]))
+
+        pairs, paths = tree.get_pairs(get_paths=True, window=self.window)
+        ids = []
+        for pair, path in zip(pairs, paths):
+            pair_id = self.pair_ids.get(pair)
+            if pair_id is None:
+                pair_id = self.pair_ids[pair] = len(self.pairs)
+                self.pairs.append(pair)
+                self.distances[pair_id] = pair_fields(pair)[2]
+                self.postings.append([])
+            self.postings[pair_id].append((expr_id, path))
+            ids.append(pair_id)
+        self.expr_pairs.append(ids)
+
+        for ranker, scores in zip(self.rankers, self.scores):
+            scores.append(ranker.search_score(ids, distances=self.distances))
+        return True
+
+    def add_all(self, trees):
+        """
+        Add symbol trees to the segment
+
+        :rtype: int
+        :return: number of new expressions added
+        """
+        return sum(self.add(tree) for tree in trees)
+
+    def sections(self):
+        """
+        Return the arrays and strings stored in the segment
+
+        :rtype: (dict, list((str, numpy.ndarray or str)))
+        :return: metadata and named sections
+        """
+        # Pair ids are assigned in the order of the encoded pairs, so pairs can be found by bisection.
+        encoded = [p.encode('utf-8') for p in self.pairs]
+        order = sorted(xrange(len(self.pairs)), key=encoded.__getitem__)
+        new_ids = np.zeros(len(self.pairs), dtype=np.int64)
+        new_ids[order] = np.arange(len(order))
+
+        counts = np.array([len(self.postings[i]) for i in order], dtype=np.int64)
+        posting_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(counts, out=posting_offsets[1:])
+        exprs = np.array([e for i in order for e, _ in self.postings[i]], dtype=np.int32)
+        distances = np.array([self.distances[i] for i in order], dtype=np.float64)
+
+        # Result scores that depend on pair frequencies are computed over the whole segment.
+        num_exprs = len(self.latex)
+        lengths = np.array([len(ids) for ids in self.expr_pairs], dtype=np.int64)
+        owners = np.repeat(np.arange(num_exprs), lengths)
+        pair_ids = new_ids[np.array([p for ids in self.expr_pairs for p in ids], dtype=np.int64)]
+        score_sections = []
+        min_weights = {}
+        for ranker, scores in zip(self.rankers, self.scores):
+            if hasattr(ranker, 'pair_weights'):
+                weights = ranker.pair_weights(counts.astype(np.float64), distances, num_exprs)
+                scores = np.bincount(owners, weights=weights[pair_ids], minlength=num_exprs)
+                min_weights[ranker.result_score_key] = float(weights.min()) if len(weights) else 0.0
+            score_sections.append(('scores.%s' % ranker.result_score_key,
+                                   np.asarray(scores, dtype=np.float64)))
+
+        sections = []
+        for name, strings in [('pairs', [encoded[i] for i in order]),
+                              ('paths', [path for i in order for _, path in self.postings[i]]),
+                              ('latex', [l or '' for l in self.latex]),
+                              ('docs', [u'\n'.join(sorted(d)) if d else '' for d in self.docs])]:
+            offsets, data = string_sections(strings)
+            sections.extend([(name + '.offsets', offsets), (name + '.data', data)])
+        fingerprints = sorted(self.expr_ids)
+        sections.extend([('distances', distances),
+                         ('postings.offsets', posting_offsets),
+                         ('postings.exprs', exprs),
+                         ('fingerprints', np.array(fingerprints, dtype='S16')),
+                         ('fingerprints.exprs', np.array([self.expr_ids[f] for f in fingerprints],
+                                                         dtype=np.int64))])
+        sections.extend(score_sections)
+        return {'total_exprs': num_exprs, 'window': self.window, 'min_weights': min_weights}, sections
+
+    def write(self, filename):
+        """
+        Write the segment, replacing any existing file only once it is complete
+
+        :type filename: string
+        :param filename: segment file name
+        """
+        metadata, sections = self.sections()
+        layout = {}
+        offset = 0
+        for name, section in sections:
+            if isinstance(section, str):
+                dtype, length, size = '|u1', len(section), len(section)
+            else:
+                dtype, length, size = section.dtype.str, len(section), section.nbytes
+            layout[name] = (dtype, offset, length)
+            offset += size + (-size % 8)
+        metadata['sections'] = layout
+        header = json.dumps(metadata)
+        header += ' ' * (-(len(MAGIC) + len(header) + 1) % 8) + '\n'
+
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC + header)
+            for name, section in sections:
+                data = section if isinstance(section, str) else section.tostring()
+                f.write(data + '\0' * (-len(data) % 8))
+        os.rename(tmp, filename)
+
+
+class SegmentIndex(Index):
+    """
+    Index served from a memory mapped segment file
+    """
+    def __init__(self, filename, ranker=None, result_cache_size=1000):
+        """
+        :type filename: string
+        :param filename: segment file written by SegmentWriter
+
+        :type ranker: object
+        :param ranker: ranker used by search, FMeasureRanker by default
+
+        :type result_cache_size: int
+        :param result_cache_size: number of result pages kept in memory, 0 disables the cache
+        """
+        self.ranker = ranker if ranker else FMeasureRanker()
+        self.result_cache = LRUCache(result_cache_size) if result_cache_size else None
+
+        with open(filename, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a tangent segment' % filename)
+        end = self.map.find('\n', len(MAGIC))
+        metadata = json.loads(self.map[len(MAGIC):end])
+        self.data_start = end + 1
+        self.sections = metadata['sections']
+        self.num_exprs = metadata['total_exprs']
+        self.window = tuple(metadata['window']) if metadata.get('window') else None
+        self.min_weights = metadata.get('min_weights', {})
+
+        self.pairs = self.strings('pairs')
+        self.paths = self.strings('paths')
+        self.latex = self.strings('latex')
+        self.docs = self.strings('docs')
+        self.distances = self.array('distances')
+        self.posting_offsets = self.array('postings.offsets')
+        self.exprs = self.array('postings.exprs')
+        # Segments written before fingerprints were introduced cannot answer exact searches.
+        if 'fingerprints' in self.sections:
+            self.fingerprints = self.array('fingerprints')
+            self.fingerprint_exprs = self.array('fingerprints.exprs')
+        else:
+            self.fingerprints = None
+
+    def array(self, name):
+        """
+        Return a section as a read-only view of the mapping
+        """
+        dtype, offset, length = self.sections[name]
+        return np.frombuffer(self.map, dtype, length, self.data_start + offset)
+
+    def strings(self, name):
+        """
+        Return a string section as a StringStore slicing the mapping
+        """
+        return StringStore(self.array(name + '.offsets'), self.map,
+                           self.data_start + self.sections[name + '.data'][1])
+
+    def total_exprs(self):
+        return self.num_exprs
+
+    def min_pair_weight(self):
+        return self.min_weights.get(self.ranker.result_score_key)
+
+    def lookup_pairs(self, pairs):
+        """
+        Return the ids of the pairs and the horizontal distance of each id
+
+        :type pairs: list
+        :param pairs: list of symbol pairs
+
+        :rtype: (list(int), dict(int,int))
+        :return: pair ids, negative for pairs that are not in the index, and horizontal distances
+        """
+        unknown = {}
+        ids = []
+        distances = {}
+        for pair in pairs:
+            encoded = pair.encode('utf-8')
+            pair_id = bisect_left(self.pairs, encoded)
+            if pair_id == len(self.pairs) or self.pairs[pair_id] != encoded:
+                pair_id = unknown.setdefault(pair, -1 - len(unknown))
+                distances[pair_id] = pair_fields(pair)[2]
+            else:
+                distances[pair_id] = int(self.distances[pair_id])
+            ids.append(pair_id)
+        return ids, distances
+
+    def pair_frequencies(self, pair_ids):
+        """
+        Return the frequency of each pair, from the posting offsets
+
+        :type pair_ids: list(int)
+        :param pair_ids: ids of indexed pairs
+
+        :rtype: list(int)
+        :return: number of postings of each pair
+        """
+        ids = np.asarray(pair_ids, dtype=np.int64)
+        return (self.posting_offsets[ids + 1] - self.posting_offsets[ids]).tolist()
+
+    def exact_match(self, search_tree):
+        if self.fingerprints is None:
+            return None
+        # Compare as arrays, since NumPy drops the trailing null bytes of string scalars.
+        fingerprint = np.array([search_tree.fingerprint()], dtype='S16')
+        i = int(np.searchsorted(self.fingerprints, fingerprint)[0])
+        if i < len(self.fingerprints) and self.fingerprints[i:i + 1] == fingerprint:
+            return int(self.fingerprint_exprs[i])
+        return None
+
+    def fetch_postings(self, pair_ids, fetch_paths=False):
+        """
+        Return the posting list of each pair
+
+        :type pair_ids: list(int)
+        :param pair_ids: ids of indexed pairs
+
+        :type fetch_paths: bool
+        :param fetch_paths: also return the path of each posting
+
+        :rtype: list((numpy.ndarray, list))
+        :return: expression ids and paths (None unless requested) of each pair
+        """
+        postings = []
+        for pair_id in pair_ids:
+            start, end = int(self.posting_offsets[pair_id]), int(self.posting_offsets[pair_id + 1])
+            paths = self.paths.slice(start, end) if fetch_paths else None
+            postings.append((self.exprs[start:end], paths))
+        return postings
+
+    def result_scores(self, expr_ids):
+        scores = self.array('scores.%s' % self.ranker.result_score_key)
+        return scores[np.asarray(expr_ids, dtype=np.int64)]
+
+    def get_latex(self, expr_id):
+        return self.latex[expr_id]
+
+    def fetch_results(self, expr_ids):
+        """
+        Return the tex, documents and mathml of each expression
+
+        Segments do not store mathml, so it is always None.
+
+        :type expr_ids: list(int)
+        :param expr_ids: expression ids
+
+        :rtype: list((str,list(str),str))
+        :return: tex, sorted documents cut to max_links, and None for the mathml
+        """
+        results = []
+        for expr_id in expr_ids:
+            docs = self.docs[expr_id]
+            documents = docs.split('\n')[:self.max_links] if docs else []
+            results.append((self.latex[expr_id], documents, None))
+        return results
+
+    def get_document_links(self, expr_id):
+        """
+        Return all links that expression occurs in
+
+        :type expr_id:int
+        :param expr_id:expression id
+
+
+        :rtype: list[(str,str)]
+        :return: list of of  wikipedia link
+        """
+        docs = self.docs[expr_id]
+        return [self.create_document_link(d) for d in docs.split('\n')] if docs else []
+
+    def random(self):
+        """
+        Return the tex of a random expression
+        """
+        return self.latex[randint(1, self.num_exprs - 1)]
@@ -0,0 +1,332 @@
+"""
+    Tangent
+    Copyright (c) 2013 David Stalnaker, Richard Zanibbi
+
+    This file is part of Tangent.
+
+    Tanget is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Tangent is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Tangent.  If not, see <http://www.gnu.org/licenses/>.
+
+    Contact:
+        - David Stalnaker: david.stalnaker@gmail.com
+        - Richard Zanibbi: rlaz@cs.rit.edu
+"""
+
+"""
+Index partitioned across several redis instances
+
+Each shard is a complete RedisIndex holding part of the expressions. A tree is stored on the shard
+picked by its fingerprint, so all copies of an expression land on the same shard and exact search
+only asks that shard. The expression id of shard s with local id i is i * num_shards + s.
+
+Frequency based rankers need the statistics of the whole collection: a search first gathers the
+number of expressions and the frequency of each query pair from the in memory tables of every
+shard, then ranks on all shards in parallel with these totals, merges their top results and only
+fetches the text and documents of the winners. The second pass weights the pairs of every shard
+with the global frequencies as well, so the shards score exactly like a single index would.
+"""
+
+import struct
+import sys
+import threading
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+from Queue import Queue
+from random import uniform
+
+import numpy as np
+import redis
+
+from tangent import Index, LRUCache, RedisIndex, StageTimer, FMeasureRanker
+
+
+class ShardedIndex(Index):
+    """
+    Scatter-gather index over several RedisIndex shards
+    """
+    def __init__(self, connections, ranker=None, result_cache_size=1000, window=None):
+        """
+        :type connections: list(StrictRedis)
+        :param connections: redis client of each shard, in a fixed order
+
+        :type ranker: object
+        :param ranker: ranker used by search, FMeasureRanker by default
+
+        :type result_cache_size: int
+        :param result_cache_size: number of result pages kept in memory, 0 disables the cache
+
+        :type window: (int, int)
+        :param window: maximum horizontal distance and nesting depth of the pairs of a new index
+        """
+        self.ranker = ranker if ranker else FMeasureRanker()
+        self.result_cache = LRUCache(result_cache_size) if result_cache_size else None
+        self.shards = [RedisIndex(ranker=self.ranker, result_cache_size=0, window=window,
+                                  connection=connection) for connection in connections]
+        windows = set(shard.window for shard in self.shards)
+        if len(windows) > 1:
+            raise ValueError('shards were built with different pair windows: %s' % sorted(windows))
+        self.window = windows.pop()
+        self.pool = ThreadPool(len(self.shards))
+
+    @classmethod
+    def from_urls(cls, urls, max_connections=None, **kwargs):
+        """
+        Connect to the shards given by redis urls, such as redis://localhost:6380/0
+
+        :type urls: list(str)
+        :param urls: url of each shard, in a fixed order
+
+        :type max_connections: int
+        :param max_connections: size of the connection pool of each shard, as in RedisIndex;
+            None for unbounded pools
+
+        :rtype: ShardedIndex
+        :return: index over the shards
+        """
+        if max_connections:
+            connections = [redis.StrictRedis(connection_pool=redis.BlockingConnectionPool.from_url(
+                url, max_connections=max_connections)) for url in urls]
+        else:
+            connections = [redis.StrictRedis.from_url(url) for url in urls]
+        return cls(connections, **kwargs)
+
+    def shard_of(self, tree):
+        """
+        Return the number of the shard holding a tree
+        """
+        return struct.unpack('<Q', tree.fingerprint()[:8])[0] % len(self.shards)
+
+    def global_id(self, shard, expr_id):
+        return expr_id * len(self.shards) + shard
+
+    def local_id(self, expr_id):
+        """
+        Return the shard and local id of an expression id
+
+        :rtype: (int, int)
+        :return: shard number and expression id within the shard
+        """
+        return expr_id % len(self.shards), expr_id // len(self.shards)
+
+    def refresh(self):
+        for shard in self.shards:
+            shard.refresh()
+
+    def generation(self):
+        # Shard generations only grow, so their sum changes whenever any shard does.
+        return sum(shard.generation() for shard in self.shards)
+
+    def scores_current(self):
+        # The scores of every shard depend on the frequencies in all of them.
+        return all(shard.scores_current() for shard in self.shards)
+
+    def total_exprs(self):
+        # Every shard counts the unused expression id 0.
+        return sum(shard.total_exprs() - 1 for shard in self.shards) + 1
+
+    def random(self):
+        """
+        Return the tex of a random expression, picking shards in proportion to their size
+        """
+        sizes = [shard.total_exprs() - 1 for shard in self.shards]
+        pick = uniform(0, sum(sizes))
+        for shard, size in zip(self.shards, sizes):
+            if pick < size:
+                return shard.random()
+            pick -= size
+        return self.shards[-1].random()
+
+    def get_latex(self, expr_id):
+        shard, expr_id = self.local_id(expr_id)
+        return self.shards[shard].get_latex(expr_id)
+
+    def get_document_links(self, expr_id):
+        shard, expr_id = self.local_id(expr_id)
+        return self.shards[shard].get_document_links(expr_id)
+
+    def add(self, tree):
+        """
+        Add symbol tree to the shard it belongs to
+
+        :type tree: SymbolTree
+        :param tree:Symbol Tree
+        """
+        self.shards[self.shard_of(tree)].add(tree)
+
+    def add_all(self, trees, batch_size=1000):
+        """
+        Add symbol trees to the index, each shard writing its trees from its own thread
+
+        :type trees: iterable(SymbolTree)
+        :param trees: Symbol Trees
+
+        :type batch_size: int
+        :param batch_size: number of trees written per pipeline by each shard
+
+        :rtype: int
+        :return: number of new expressions added
+        """
+        queues = [Queue(batch_size) for _ in self.shards]
+        added = [0] * len(self.shards)
+        errors = []
+
+        def consume(i):
+            try:
+                added[i] = self.shards[i].add_all(iter(queues[i].get, None), batch_size)
+            except Exception:
+                errors.append(sys.exc_info())
+                # Keep draining the queue so the producer is not blocked.
+                for _ in iter(queues[i].get, None):
+                    pass
+
+        threads = [threading.Thread(target=consume, args=(i,)) for i in range(len(self.shards))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            for tree in trees:
+                queues[self.shard_of(tree)].put(tree)
+        finally:
+            for queue in queues:
+                queue.put(None)
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return sum(added)
+
+    def second_pass(self, incremental=False, max_growth=0.1):
+        """
+        Compute the result scores of every shard with the pair frequencies of the whole index
+
+        The frequencies of all shards change whenever one of them grows, so every pass is a full
+        one; incremental and max_growth are only accepted for compatibility with RedisIndex.
+
+        :rtype: bool
+        :return: True, every expression was rescored
+        """
+        counts = defaultdict(int)
+        for shard in self.shards:
+            shard.pair_dict.load()
+            shard.frequencies.load()
+            for pair, count in zip(shard.pair_dict.pairs, shard.frequencies.counts.tolist()):
+                if pair is not None and count > 0:
+                    counts[pair] += count
+        total_exprs = self.total_exprs()
+        for shard in self.shards:
+            shard_counts = np.array([counts[pair] if pair is not None else 0
+                                     for pair in shard.pair_dict.pairs], dtype=np.float64)
+            shard.second_pass(statistics=(shard_counts, total_exprs))
+        return True
+
+    def statistics(self, search_tree):
+        """
+        Return the number of expressions and the frequency of each pair of the tree in the whole
+        index, from the in memory tables of the shards
+
+        :type search_tree: SymbolTree
+        :param search_tree: Symbol Tree
+
+        :rtype: (int, dict(str,int))
+        :return: number of expressions and frequency of each search pair
+        """
+        pairs = list(set(search_tree.get_pairs(window=self.window)))
+
+        def shard_statistics(shard):
+            shard.refresh()
+            total_exprs = shard.total_exprs()
+            ids, _ = shard.lookup_pairs(pairs)
+            known = [(pair, pair_id) for pair, pair_id in zip(pairs, ids) if pair_id >= 0]
+            frequencies = shard.pair_frequencies([pair_id for _, pair_id in known])
+            return total_exprs, zip([pair for pair, _ in known], frequencies)
+
+        counts = dict((pair, 0) for pair in pairs)
+        total_exprs = 1
+        for shard_exprs, frequencies in self.pool.map(shard_statistics, self.shards):
+            total_exprs += shard_exprs - 1
+            for pair, count in frequencies:
+                counts[pair] += count or 0
+        return total_exprs, counts
+
+    def search_uncached(self, search_tree, k=10, offset=0):
+        """
+        Return all matches for this search tree, merged from the top matches of every shard
+
+        :type search_tree: SymbolTree
+        :param search_tree:Symbol Tree
+
+        :type k: int
+        :param k: number of results to return
+
+        :type offset: int
+        :param offset: number of top results to skip, for pagination
+
+        :rtype: (list[Result], int, dict(str,int))
+        :return: top search results, number of matches and frequency of each search pair
+        """
+        timer = StageTimer()
+        # Compute the pairs once, the shards read them concurrently.
+        search_tree.compute_pairs(self.window)
+        statistics = self.statistics(search_tree)
+        timer.lap('statistics')
+
+        views = []
+        prune = self.prune and self.scores_current()
+        for shard in self.shards:
+            view = shard.with_ranker(self.ranker)
+            view.prune = prune
+            view.prune_batch = self.prune_batch
+            view.exact_first = self.exact_first
+            view.max_links = self.max_links
+            view.fetch_mathml = self.fetch_mathml
+            views.append(view)
+
+        def shard_top(view):
+            shard_timer = StageTimer()
+            return view.top_results(search_tree, offset + k, shard_timer, statistics), shard_timer
+
+        replies = self.pool.map(shard_top, views)
+        num_matches = 0
+        merged = []
+        for shard, ((top, shard_matches, names, _), shard_timer) in enumerate(replies):
+            num_matches += shard_matches
+            for name, value in shard_timer.counts.iteritems():
+                timer.count(name, value)
+            merged.extend((self.global_id(shard, expr_id), score, match_pairs, shard)
+                          for expr_id, score, match_pairs in top)
+
+        # Rank like a single index, breaking ties by expression id, with an exact match first.
+        merged.sort(key=lambda m: (-m[1], m[0]))
+        exact_id = None
+        if self.exact_first:
+            owner = self.shard_of(search_tree)
+            exact_id = views[owner].exact_match(search_tree)
+            if exact_id is not None:
+                exact_id = self.global_id(owner, exact_id)
+                merged.sort(key=lambda m: m[0] != exact_id)
+        merged = merged[offset:offset + k]
+        timer.lap('shards')
+
+        # Get the text and documents of the winners from their shards.
+        selected = [[] for _ in self.shards]
+        for expr_id, score, match_pairs, shard in merged:
+            selected[shard].append((self.local_id(expr_id)[1], score, match_pairs))
+        hydrated = self.pool.map(lambda i: views[i].hydrate(selected[i], replies[i][0][2]),
+                                 range(len(self.shards)))
+        by_id = dict((self.global_id(shard, result.expr_id), result)
+                     for shard, results in enumerate(hydrated) for result in results)
+        results = [by_id[expr_id]._replace(expr_id=expr_id) for expr_id, _, _, _ in merged]
+        timer.lap('hydrate')
+        if self.metrics is not None:
+            self.record_search(timer)
+        return results, num_matches, statistics[1]
@@ -22,16 +22,49 @@
         - Richard Zanibbi: rlaz@cs.rit.edu
 """
 
+import hashlib
 import re
 import os
-import subprocess
 import xml.etree.ElementTree as ET
 import StringIO
+from array import array
+from bisect import bisect_left
 from collections import deque, Counter
+from functools import partial
+from multiprocessing import Pool
 from sys import argv
 
+from tangent import LatexmlPool
+
+try:
+    import xml.etree.cElementTree as cET
+except ImportError:
+    cET = ET
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
 ET.register_namespace('', 'http://www.w3.org/1998/Math/MathML')
 
+
+def iterparse(source):
+    """
+    Return the start and end events of an xml document, parsed by lxml when it is installed
+
+    :type source: string or file
+    :param source: file name or file object
+
+    :rtype: (iterator((str, Element)), function)
+    :return: events and the function serializing an element of the document
+    """
+    if lxml_etree is not None:
+        events = lxml_etree.iterparse(source, events=('start', 'end'), remove_comments=True,
+                                      remove_pis=True)
+        return events, lxml_etree.tostring
+    return cET.iterparse(source, events=('start', 'end')), cET.tostring
+
 class MathML:
     """
     List of ecognized tags
@@ -66,66 +99,20 @@ class UnknownTagException(Exception):
         self.tag = tag
 
 
-class Symbol:
+class Symbol(object):
     """
-    Symbol in a symbol tree
+    Symbol in a symbol tree, used while parsing
+
+    SymbolTree copies the symbols into flat arrays, so Symbols only live until their tree is built.
     """
+    __slots__ = ['tag', 'next', 'above', 'below', 'within']
+
     def __init__(self, tag, next=None, above=None, below=None, within=None):
         self.tag = tag
         self.next = next
         self.above = above
         self.below = below
         self.within = within
-        self.id = None
-
-    def build_repr(self, builder):
-        """
-        Build representation of symbol
-        """
-        builder.append('(')
-        builder.append(self.tag)
-        if self.next:
-            builder.append(',next=')
-            self.next.build_repr(builder)
-        if self.above:
-            builder.append(',above=')
-            self.above.build_repr(builder)
-        if self.below:
-            builder.append(',below=')
-            self.below.build_repr(builder)
-        if self.within:
-            builder.append(',within=')
-            self.within.build_repr(builder)
-        builder.append(')')
-
-    def get_symbols(self):
-        return SymbolIterator(self)
-
-    def generate_ids(self, prefix=(0,)):
-        self.id = prefix
-        for child, v_dist in [(self.above, 1), (self.next, 0), (self.below, 2), (self.within, 3)]:
-            if child:
-                child.generate_ids(prefix + (v_dist,))
-
-    def get_pairs(self):
-        """
-        Return the pairs in the symbol tree
-
-        :rtype list
-        :return list of symbols
-        """
-        def mk_helper(v_dist_diff):
-            def helper(tup):
-                right, h_dist, v_dist = tup
-                return (self.tag, right.tag, h_dist + 1, v_dist + v_dist_diff, right.id)
-            return helper
-
-        ret = []
-        for child, v_dist in [(self.above, 1), (self.next, 0), (self.below, -1), (self.within, 0)]:
-            if child:
-                ret.extend(map(mk_helper(v_dist), child.get_symbols()))
-                ret.extend(child.get_pairs())
-        return ret
 
     @classmethod
     def parse_from_mathml(cls, elem):
@@ -257,9 +244,13 @@ class Symbol:
 class SymbolIterator(object):
     """
     Iterator over a symbol tree
+
+    Yields the index of each symbol below node (included) with its horizontal and vertical distance
+    from node.
     """
-    def __init__(self, node):
-        self.stack = deque([(node, 0, 0)] if node else [])
+    def __init__(self, tree, node=0):
+        self.links = tree.links
+        self.stack = deque([(node, 0, 0)] if tree.tags else [])
 
     def __iter__(self):
         return self
@@ -268,50 +259,178 @@ class SymbolIterator(object):
         if len(self.stack) < 1:
             raise StopIteration
         (elem, h_dist, v_dist) = self.stack.pop()
-        if elem.below:
-            self.stack.append((elem.below, h_dist + 1, v_dist - 1))
-        if elem.next:
-            self.stack.append((elem.next, h_dist + 1, v_dist))
-        if elem.above:
-            self.stack.append((elem.above, h_dist + 1, v_dist + 1))
-        if elem.within:
-            self.stack.append((elem.within, h_dist + 1, v_dist))
+        above, next, below, within = self.links[4 * elem:4 * elem + 4]
+        if below >= 0:
+            self.stack.append((below, h_dist + 1, v_dist - 1))
+        if next >= 0:
+            self.stack.append((next, h_dist + 1, v_dist))
+        if above >= 0:
+            self.stack.append((above, h_dist + 1, v_dist + 1))
+        if within >= 0:
+            self.stack.append((within, h_dist + 1, v_dist))
         return (elem, h_dist, v_dist)
 
-class SymbolTree:
+
+# For each link of a symbol, in the order they are stored: the code of the link in symbol paths,
+# and the change of vertical offset and of nesting level along it.
+LINKS = [(u'1', 1, 1), (u'0', 0, 0), (u'2', -1, 1), (u'3', 0, 1)]
+
+
+class SymbolTree(object):
     """
     Symbol Tree manipulation and parsing
 
     Uses latexmlmath (http://dlmf.nist.gov/LaTeXML/index.html) to create the presentation mml
 
+    The symbols are stored in preorder as a list of tags and an array with the index of the above,
+    next, below and within child of each symbol (-1 for none). Byte string tags, which lxml
+    returns for ascii text, are interned so trees share them; interned strings are freed with the
+    last tree using them, so searching for new symbols does not grow the process.
     """
-    __slots__ = ['root', 'latex', 'mathml', 'document']
+    __slots__ = ['tags', 'links', 'latex', 'mathml', 'document', 'pairs', 'window']
 
-    def __init__(self, root):
-        self.root = root
-        self.root.generate_ids()
+    # LatexmlPool shared by all tex conversions, created on first use if not configured.
+    converter = None
+    # Optional TexCache consulted before converting tex.
+    tex_cache = None
 
-    def get_pairs(self, get_paths=False):
+    def __init__(self, root):
+        """
+        :type root: Symbol
+        :param root: first symbol of the tree
+        """
+        tags = []
+        links = array('i')
+        stack = [(root, -1)]
+        while stack:
+            symbol, slot = stack.pop()
+            if slot >= 0:
+                links[slot] = len(tags)
+            links.extend([-1, -1, -1, -1])
+            tags.append(intern(symbol.tag) if type(symbol.tag) is str else symbol.tag)
+            for i, child in reversed(list(enumerate([symbol.above, symbol.next, symbol.below,
+                                                     symbol.within]))):
+                if child:
+                    stack.append((child, len(links) - 4 + i))
+        self.tags = tags
+        self.links = links
+        self.pairs = None
+        self.window = None
+        self.latex = None
+        self.mathml = None
+        self.document = None
+
+    def get_pairs(self, get_paths=False, window=None):
         """
         Return list of symbols
 
+        :type window: (int, int)
+        :param window: maximum horizontal distance and nesting depth of the pairs (None for no
+            limit), or None for all pairs
+
         :rtype: list
         :return list of symbols
         """
+        if self.pairs is not None and self.window == window:
+            # Pairs were precomputed, by a parsing worker for instance.
+            return self.pairs if get_paths else self.pairs[0]
         if get_paths:
             pairs = []
             paths = []
-            for s1, s2, dh, dv, path in self.root.get_pairs():
-                pairs.append(('|'.join(map(unicode, [s1.replace('|', '!@!'), s2.replace('|', '!@!'), dh, dv]))))
-                paths.append(''.join(map(unicode, path)))
+            for pair, path in self.iter_pairs(window):
+                pairs.append(pair)
+                paths.append(path)
             return pairs, paths
         else: 
-            return ['|'.join(map(unicode, [s1.replace('|', '!@!'), s2.replace('|', '!@!'), dh, dv]))
-                    for s1, s2, dh, dv, _
-                    in self.root.get_pairs()]
+            return [pair for pair, _ in self.iter_pairs(window)]
+
+    def compute_pairs(self, window=None):
+        """
+        Compute the pairs and paths of the tree once, for later get_pairs calls with the same window
+        """
+        self.pairs = self.get_pairs(get_paths=True, window=window)
+        self.window = window
+
+    def iter_pairs(self, window=None):
+        """
+        Generate the symbol pairs of the tree with their paths, without building lists
+
+        :type window: (int, int)
+        :param window: maximum horizontal distance and nesting depth of the pairs, or None
+
+        :rtype: generator
+        :return: (pair, path of the second symbol)
+        """
+        escaped = {}
+        last_path = None
+        for s1, s2, dh, dv, path in self.iter_symbol_pairs(*(window or ())):
+            # The pairs of a symbol with its ancestors are consecutive, so its tag and path are
+            # only formatted once.
+            if path is not last_path:
+                last_path = path
+                p = u''.join(map(unicode, path))
+                e2 = unicode(s2).replace('|', '!@!')
+            e1 = escaped.get(s1)
+            if e1 is None:
+                e1 = escaped[s1] = unicode(s1).replace('|', '!@!')
+            yield u'%s|%s|%d|%d' % (e1, e2, dh, dv), p
+
+    def iter_symbol_pairs(self, max_dh=None, max_depth=None):
+        """
+        Generate the pairs in the symbol tree with a single pass over the symbols
+
+        Every symbol is paired with each of its ancestors. Since the symbols are in preorder, the
+        ancestors of a symbol are the last symbols seen at each smaller depth; their tags, vertical
+        offsets and nesting levels (the number of above, below and within links from the root) are
+        kept on stacks indexed by depth, so the distances of a pair are the differences of depth
+        and offset.
+
+        :type max_dh: int
+        :param max_dh: only pair symbols at most this horizontal distance apart, None for no limit
+
+        :type max_depth: int
+        :param max_depth: only pair symbols at most this many nesting levels apart, None for no limit
+
+        :rtype generator
+        :return (tag, tag, horizontal distance, vertical distance, path of the second symbol)
+        """
+        tags = self.tags
+        links = self.links
+        num_symbols = len(tags)
+        depths = [0] * num_symbols
+        v_dists = [0] * num_symbols
+        nesting = [0] * num_symbols
+        paths = [u'0'] * num_symbols
+
+        ancestors = []
+        levels = []
+        for elem in xrange(num_symbols):
+            depth, v_dist, level, path = depths[elem], v_dists[elem], nesting[elem], paths[elem]
+            del ancestors[depth:]
+            del levels[depth:]
+
+            # Ancestors within the window are a suffix of the stack, as levels never decrease.
+            first = 0
+            if max_dh is not None:
+                first = max(depth - max_dh, 0)
+            if max_depth is not None:
+                first = max(first, bisect_left(levels, level - max_depth))
+
+            tag = tags[elem]
+            for a_depth, (a_tag, a_v_dist) in enumerate(ancestors[first:], first):
+                yield (a_tag, tag, depth - a_depth, v_dist - a_v_dist, path)
+            ancestors.append((tag, v_dist))
+            levels.append(level)
+
+            for child, (code, v_diff, level_diff) in zip(links[4 * elem:4 * elem + 4], LINKS):
+                if child >= 0:
+                    depths[child] = depth + 1
+                    v_dists[child] = v_dist + v_diff
+                    nesting[child] = level + level_diff
+                    paths[child] = path + code
 
     def get_symbols(self):
-        return self.root.get_symbols()
+        return SymbolIterator(self)
 
     @classmethod
     def parse(cls, filename, missing_tags=None):
@@ -321,15 +440,15 @@ class SymbolTree:
         :type filename: string
         :param filename: directory to seach in
 
-        :rtype: list(SymbolTree)
-        :return list of Symbol trees
+        :rtype: iterable(SymbolTree)
+        :return Symbol trees, xml files are parsed as the trees are consumed
         """
         ext = os.path.splitext(filename)[1]
         if ext == '.tex':
             with open(filename) as f:
                 return [cls.parse_from_tex(f.read())]
         elif ext in {'.xhtml', '.mathml', '.mml'}:
-            return cls.parse_all_from_xml(filename, missing_tags=missing_tags)
+            return cls.iter_all_from_xml(filename, missing_tags=missing_tags)
         else:
             print('Unknown filetype for %s' % filename)
             return []
@@ -347,9 +466,17 @@ class SymbolTree:
         :return SymbolTree
         """
 
-        p = subprocess.Popen('latexmlmath -pmml - -', shell=True, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=open('/dev/null', 'r'))
-        (output, _) = p.communicate(input=tex)
-        f = StringIO.StringIO(output)
+        mathml = cls.tex_cache.get(tex) if cls.tex_cache is not None else None
+        if mathml is None:
+            if cls.converter is None:
+                cls.converter = LatexmlPool()
+            mathml = cls.converter.convert(tex)
+            tree = cls.parse_all_from_xml(StringIO.StringIO(mathml))[0]
+            # Only mathml that parsed into a tree is cached.
+            if cls.tex_cache is not None:
+                cls.tex_cache.put(tex, mathml)
+            return tree
+        f = StringIO.StringIO(mathml)
         return cls.parse_all_from_xml(f)[0]
 
     @classmethod
@@ -363,6 +490,9 @@ class SymbolTree:
         :rtype SymbolTree
         :return SymbolTree
         """
+        # The parsers read bytes, the encoding is given by the xml declaration or defaults to utf-8.
+        if isinstance(mathml, unicode):
+            mathml = mathml.encode('utf-8')
         f = StringIO.StringIO(mathml)
         return cls.parse_all_from_xml(f)[0]
 
@@ -397,27 +527,60 @@ class SymbolTree:
         :return list of Symbol trees found in file
 
         """
-        trees = []
-        for event, elem in ET.iterparse(filename):
-            if event == 'end' and elem.tag == MathML.math:
+        return list(cls.iter_all_from_xml(filename, missing_tags=missing_tags))
+
+    @classmethod
+    def iter_all_from_xml(cls, filename, missing_tags=None):
+        """
+        Generate the expressions of an xml file while it is parsed
+
+        Each math element is serialized once and cleared as soon as its tree is built, and every
+        finished element outside math elements is detached from its parent, so memory use does not
+        grow with the size of the file.
+
+        :param filename File name or file object
+        :type  filename: string
+
+        :rtype generator(SymbolTree)
+        :return Symbol trees found in file
+        """
+        events, tostring = iterparse(filename)
+        open_elements = []
+        math_depth = 0
+        for event, elem in events:
+            if event == 'start':
+                open_elements.append(elem)
+                if elem.tag == MathML.math:
+                    math_depth += 1
+                continue
+
+            open_elements.pop()
+            if elem.tag == MathML.math:
+                math_depth -= 1
                 try:
-                    tree = cls.parse_from_mathml(elem)
-                    if 'alttext' in elem.attrib:
-                        tree.latex = elem.attrib['alttext']
-                    else:
-                        tree.latex = ''
+                    tree = cls(Symbol.parse_from_mathml(elem))
+                    tree.latex = elem.attrib.get('alttext', '')
                     elem.tail = None
-                    elem.attrib = {}
-                    tree.mathml = ET.tostring(elem)
+                    elem.attrib.clear()
+                    tree.mathml = tostring(elem)
                     tree.document = filename
-                    trees.append(tree)
                 except UnknownTagException as e:
                     if missing_tags is not None:
                         missing_tags.update([e.tag])
                 except Exception as e:
                     if missing_tags is not None:
                         missing_tags.update(['Unknown error: ' + e.message])
-        return trees
+                else:
+                    yield tree
+
+            # Elements of a math element are needed until the whole expression is parsed. Finished
+            # siblings are dropped up to elem, as lxml may already have added the following ones.
+            if math_depth == 0:
+                elem.clear()
+                if open_elements:
+                    parent = open_elements[-1]
+                    while parent[0] is not elem:
+                        del parent[0]
 
     @classmethod
     def count_tags(cls, directory):
@@ -441,12 +604,21 @@ class SymbolTree:
             print('%s, %d' % (tag, count))
 
     @classmethod
-    def parse_directory(cls, directory):
+    def parse_directory(cls, directory, processes=1, window=None):
         """
         Parse the symbols in the files in the directory
 
+        With more than one process, files are parsed in parallel by a pool of worker processes that
+        also compute the pairs of each tree, and the trees are streamed back in file order.
+
         :param directory Directory to search in
         :type  directory: string
+
+        :param processes Number of parsing processes
+        :type  processes: int
+
+        :param window Pair window of the index the trees are parsed for
+        :type  window: (int, int)
         """
         missing_tags = Counter()
         fullnames = []
@@ -467,15 +639,75 @@ class SymbolTree:
                 for t in cls.parse(fullname, missing_tags=missing_tags):
                     stats['num_expressions'] += 1
                     yield t
-        return get(), stats
+
+        def get_parallel():
+            pool = Pool(processes)
+            try:
+                results = pool.imap(partial(parse_file, window=window), fullnames)
+                for i, (fullname, trees, file_missing_tags) in enumerate(results):
+                    print('parsed %s (%d of %d)' % (fullname, i + 1, len(fullnames)))
+                    missing_tags.update(file_missing_tags)
+                    for t in trees:
+                        stats['num_expressions'] += 1
+                        yield t
+                # Workers that exit on their own stop the latexmls daemons they started.
+                pool.close()
+                pool.join()
+            finally:
+                pool.terminate()
+
+        return (get_parallel() if processes > 1 else get()), stats
 
 
     def build_repr(self):
+        # Strings on the stack are emitted as is, so deep trees do not hit the recursion limit.
         builder = []
-        self.root.build_repr(builder)
+        stack = [0] if self.tags else []
+        while stack:
+            elem = stack.pop()
+            if isinstance(elem, basestring):
+                builder.append(elem)
+                continue
+            above, next, below, within = self.links[4 * elem:4 * elem + 4]
+            builder.append('(')
+            builder.append(self.tags[elem])
+            stack.append(')')
+            for child, label in [(within, ',within='), (below, ',below='), (above, ',above='),
+                                 (next, ',next=')]:
+                if child >= 0:
+                    stack.append(child)
+                    stack.append(label)
         builder = [b for b in builder if b]
         return u'SymbolTree(%s)' % u''.join(builder)
 
+    def fingerprint(self):
+        """
+        Return a fixed size digest of build_repr, identifying the tree for exact search
+
+        :rtype: str
+        :return: 16 byte MD5 digest
+        """
+        return hashlib.md5(self.build_repr().encode('utf-8')).digest()
+
+def parse_file(fullname, window=None):
+    """
+    Parse a file and compute the pairs of its trees, for use by parse_directory's worker processes
+
+    :param fullname File to parse
+    :type  fullname: string
+
+    :param window Pair window of the index the trees are parsed for
+    :type  window: (int, int)
+
+    :rtype (string, list(SymbolTree), Counter)
+    :return file name, Symbol trees found in the file and the tags that could not be parsed
+    """
+    missing_tags = Counter()
+    trees = list(SymbolTree.parse(fullname, missing_tags=missing_tags))
+    for t in trees:
+        t.compute_pairs(window)
+    return fullname, trees, missing_tags
+
 if __name__ == '__main__':
     trees = SymbolTree.parse_all(argv[1])
     print('%d expressions parsed' % len(trees))
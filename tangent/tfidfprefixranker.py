@@ -27,6 +27,8 @@ from math import log
 from collections import deque, Counter, defaultdict
 from itertools import izip_longest, izip
 
+import numpy as np
+
 def prefix(search_path, result_path):
     """
     Return shared prefix
@@ -60,12 +62,12 @@ class TfIdfPrefixRanker(object):
     """
 
     @staticmethod
-    def search_score(search_pairs, pair_counts=None, total_exprs=None):
+    def search_score(search_pairs, pair_counts=None, total_exprs=None, distances=None):
         """
         Score for search pairs is the sum of the idf or the length of search pairs
 
         :type search_pairs: list
-        :param search_pairs: list of symbol pairs
+        :param search_pairs: list of symbol pair ids
 
         :rtype: double
         :return: score for this expression
@@ -81,12 +83,12 @@ class TfIdfPrefixRanker(object):
     fetch_paths = True
 
     @staticmethod
-    def rank(match_pairs, search_score, result_score, pair_counts, total_exprs, search_paths):
+    def rank(match_pairs, search_score, result_score, pair_counts, total_exprs, search_paths, distances=None):
         """
         Returns tf-idf-prefix based score
 
         :type match_pairs: list
-        :param match_pairs list of pairs that latched
+        :param match_pairs list of pair ids that latched
 
         :type search_score: double
         :param search_score: score for pairs in query
@@ -95,15 +97,18 @@ class TfIdfPrefixRanker(object):
         :param result_score: score for pairs that matched
 
 
-        :type pair_counts: dict(str,int)
+        :type pair_counts: dict(int,int)
         :param pair_counts: frequency for each symbol pair
 
         :type total_exprs:
         :param total_exprs:
 
-        :type search_paths:dict(str,list)
+        :type search_paths:dict(int,list)
         :param: search_paths:given two symbol pairs, the path between them
 
+        :type distances: dict(int,int)
+        :param distances: horizontal distance of each symbol pair
+
         :rtype: double
         :return: score
 
@@ -120,25 +125,22 @@ class TfIdfPrefixRanker(object):
         match_score = max(matches.values())
         return 2 * match_score / (search_score + result_score)
 
-
     @staticmethod
-    def second_pass(db):
+    def pair_weights(counts, distances, total_exprs):
         """
-        Update the prefix score of the expressions
+        Idf of each pair, summed into the result score of each expression by the second pass
 
-        :type db: StrictRedis
-        :param db: Redis Database connection object
+        :type counts: numpy.ndarray
+        :param counts: frequency of each pair id
 
-        """
+        :type distances: numpy.ndarray
+        :param distances: horizontal distance of each pair id
 
-        pipe = db.pipeline()
-        all_pairs = list(db.smembers('all_pairs'))
-        for p in all_pairs:
-            pipe.llen('pair:%s:exprs' % p)
-        all_counts = dict((pair, int(count)) for (pair, count) in izip(all_pairs, pipe.execute()))
-
-        num_exprs = int(db.get('next_expr_id')) + 1
-        for i in range(num_exprs):
-            pairs = db.lrange('expr:%d:all_pairs' % i, 0, -1)
-            score = sum(idf(all_counts[p], num_exprs) for p in pairs)
-            db.set('expr:%d:tfidfprefix_score' % i, score)
+        :type total_exprs: int
+        :param total_exprs: number of expressions in the index
+
+        :rtype: numpy.ndarray
+        :return: weight of each pair
+
+        """
+        return np.log10(total_exprs / (counts + 1))
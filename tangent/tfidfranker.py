@@ -26,6 +26,8 @@ from __future__ import division
 from math import log
 from itertools import izip
 
+import numpy as np
+
 def idf(counts, total):
     return sum(log(total / (c + 1), 10) for c in counts)
 
@@ -45,12 +47,12 @@ class TfIdfRanker(object):
          where ief=inverse expression frequency
     """
     @staticmethod
-    def search_score(search_pairs, pair_counts=None, total_exprs=None):
+    def search_score(search_pairs, pair_counts=None, total_exprs=None, distances=None):
         """
         Score for search pairs is idf or the length of search pairs
 
         :type search_pairs: list
-        :param search_pairs: list of symbol pairs
+        :param search_pairs: list of symbol pair ids
 
         :rtype: double
         :return: score for this expression
@@ -65,12 +67,12 @@ class TfIdfRanker(object):
     fetch_paths = False
 
     @staticmethod
-    def rank(match_pairs, search_score, result_score, pair_counts, total_exprs, search_paths):
+    def rank(match_pairs, search_score, result_score, pair_counts, total_exprs, search_paths, distances=None):
         """
         Returns tf-idf based score
 
         :type match_pairs: list
-        :param match_pairs list of pairs that latched
+        :param match_pairs list of pair ids that latched
 
         :type search_score: double
         :param search_score: score for pairs in query
@@ -79,15 +81,18 @@ class TfIdfRanker(object):
         :param result_score: score for pairs that matched
 
 
-        :type pair_counts: dict(str,int)
+        :type pair_counts: dict(int,int)
         :param pair_counts: frequency for each symbol pair
 
         :type total_exprs:
         :param total_exprs:
 
-        :type search_paths:dict(str,list)
+        :type search_paths:dict(int,list)
         :param: search_paths:given two symbol pairs, the path between them
 
+        :type distances: dict(int,int)
+        :param distances: horizontal distance of each symbol pair
+
         :rtype: double
         :return: score
 
@@ -97,22 +102,42 @@ class TfIdfRanker(object):
         return 2 * match_score / (search_score + result_score)
 
     @staticmethod
-    def second_pass(db):
+    def match_weights(search_pairs, pair_counts, total_exprs, distances=None):
+        """
+        Every matched pair adds its idf to the match score m
         """
-        Update the idf score of the expressions
+        return dict((p, log(total_exprs / (pair_counts[p] + 1), 10)) for p in search_pairs)
+
+    @staticmethod
+    def rank_scores(match_scores, search_score, result_scores):
+        """
+        Idf weighted f-measure 2m / (s + r) of each candidate
+        """
+        return 2 * match_scores / (search_score + result_scores)
+
+    @staticmethod
+    def max_rank(match_score, search_score):
+        """
+        Bound 2m / (s + m), as r is at least m when no idf of the index is negative
+        """
+        return 2 * match_score / (search_score + match_score)
+
+    @staticmethod
+    def pair_weights(counts, distances, total_exprs):
+        """
+        Idf of each pair, summed into the result score of each expression by the second pass
+
+        :type counts: numpy.ndarray
+        :param counts: frequency of each pair id
+
+        :type distances: numpy.ndarray
+        :param distances: horizontal distance of each pair id
+
+        :type total_exprs: int
+        :param total_exprs: number of expressions in the index
 
-        :type db: StrictRedis
-        :param db: Redis Database connection object
+        :rtype: numpy.ndarray
+        :return: weight of each pair
 
         """
-        pipe = db.pipeline()
-        all_pairs = list(db.smembers('all_pairs'))
-        for p in all_pairs:
-            pipe.llen('pair:%s:exprs' % p)
-        all_counts = dict((pair, int(count)) for (pair, count) in izip(all_pairs, pipe.execute()))
-
-        num_exprs = int(db.get('next_expr_id')) + 1
-        for i in range(num_exprs):
-            pairs = db.lrange('expr:%d:all_pairs' % i, 0, -1)
-            counts = (all_counts[p] for p in pairs)
-            db.set('expr:%d:tfidf_score' % i, idf(counts, num_exprs))
+        return np.log10(total_exprs / (counts + 1))